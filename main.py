@@ -3,24 +3,67 @@ from time import sleep
 
 from src.helpers import parse_command_line, simulate_traffic
 from src.http_monitor import HTTPMonitor
+from src.profiling import ProfilingHooks
+from src.sharding import ShardedMonitor, expand_paths
 
 
 def main():
     args = parse_command_line()
 
-    controller = HTTPMonitor(
-        path=args.path,
-        reporting_window=args.reporting_window,
-        alert_threshold=args.alert_threshold,
-        bucket_size=args.bucket_size,
-        alert_error_rate=args.alert_error_rate,
-        alert_monitoring_window=args.alert_monitoring_window,
-        ddos_threshold=args.ddos_threshold,
-    )
+    if args.paths:
+        controller = ShardedMonitor(
+            paths=expand_paths(args.paths),
+            reporting_window=args.reporting_window,
+            alert_threshold=args.alert_threshold,
+            bucket_size=args.bucket_size,
+            alert_error_rate=args.alert_error_rate,
+            alert_monitoring_window=args.alert_monitoring_window,
+            ddos_threshold=args.ddos_threshold,
+            unique_ips_jump=args.unique_ips_jump,
+            endpoint_depth=args.endpoint_depth,
+            endpoint_routes=args.endpoint_routes,
+            max_endpoints=args.max_endpoints,
+            workers=args.workers,
+            log_format=args.log_format,
+            bandwidth_threshold=args.bandwidth_threshold,
+            prefix_threshold=args.prefix_threshold,
+            ipv6_prefixes=args.ipv6_prefixes,
+            ip_ranges=args.ip_ranges,
+        )
+    else:
+        controller = HTTPMonitor(
+            path=args.path,
+            reporting_window=args.reporting_window,
+            alert_threshold=args.alert_threshold,
+            bucket_size=args.bucket_size,
+            alert_error_rate=args.alert_error_rate,
+            alert_monitoring_window=args.alert_monitoring_window,
+            ddos_threshold=args.ddos_threshold,
+            unique_ips_jump=args.unique_ips_jump,
+            sampling_lag_target=args.sampling_lag_target,
+            history_path=args.history_path,
+            endpoint_depth=args.endpoint_depth,
+            endpoint_routes=args.endpoint_routes,
+            max_endpoints=args.max_endpoints,
+            baseline_mode=args.baseline_mode,
+            baseline_deviation=args.baseline_deviation,
+            baseline_half_life=args.baseline_half_life,
+            baseline_seasonal_days=args.baseline_seasonal_days,
+            baseline_path=args.baseline_path,
+            log_format=args.log_format,
+            block_mode=args.block_mode,
+            bandwidth_threshold=args.bandwidth_threshold,
+            prefix_threshold=args.prefix_threshold,
+            ipv6_prefixes=args.ipv6_prefixes,
+            ip_ranges=args.ip_ranges,
+        )
+
     controller.start()
+    if args.profile_dir:
+        ProfilingHooks(controller, args.profile_dir).install()
     print("HTTPMonitoring started.")
 
-    if args.give_me_traffic:
+    if args.give_me_traffic and not args.paths:
         try:
             simulate_traffic(args.path)
         except KeyboardInterrupt:
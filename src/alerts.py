@@ -1,8 +1,12 @@
 import time
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional
+
+from .histogram import format_bytes
 
 if TYPE_CHECKING:
-    from .metrics import MetricBucket
+    from .baselines import Baseline
+    from .metrics import MetricBucket, MetricsAggregator
+    from .prefixes import PrefixTree
 
 
 class AlertBase:
@@ -20,6 +24,11 @@ class AlertBase:
     def get_alert_status(self, stats: "MetricBucket"):
         raise NotImplementedError
 
+    @staticmethod
+    def approx(stats: "MetricBucket") -> str:
+        """Mark numbers scaled up from a sample, they're estimates."""
+        return "~" if stats.sample_rate < 1 else ""
+
     def as_message(self):
         return {
             "type": self.TYPE,
@@ -42,7 +51,8 @@ class TrafficAlert(AlertBase):
             if not self.is_active:
                 self.status = TrafficAlert.ALERT
                 self.message = (
-                    "Traffic above threshold - {} hits in the last {} seconds".format(
+                    "Traffic above threshold - {}{} hits in the last {} seconds".format(
+                        self.approx(stats),
                         stats.traffic,
                         self.reporting_window,
                     )
@@ -55,6 +65,36 @@ class TrafficAlert(AlertBase):
             return self.as_message()
 
 
+class BandwidthAlert(AlertBase):
+    TYPE = "BANDWIDTH_ALERT"
+
+    def __init__(self, reporting_window: float, bandwidth_threshold: float):
+        super().__init__()
+        self.reporting_window = reporting_window
+        # Bytes/second
+        self.bandwidth_threshold = bandwidth_threshold
+
+    def get_alert_status(self, stats: "MetricBucket"):
+        if stats.response_bytes >= self.bandwidth_threshold * self.reporting_window:
+            if not self.is_active:
+                self.status = BandwidthAlert.ALERT
+                self.message = (
+                    "Bandwidth above threshold - {}{}/s in the last {} seconds,"
+                    " p99 response size {}"
+                ).format(
+                    self.approx(stats),
+                    format_bytes(stats.response_bytes / self.reporting_window),
+                    self.reporting_window,
+                    format_bytes(stats.response_sizes.percentile(0.99)),
+                )
+                return self.as_message()
+
+        elif self.is_active:
+            self.status = BandwidthAlert.RECOVERED
+            self.message = "Bandwidth returned to normal range"
+            return self.as_message()
+
+
 class ErrorRateAlert(AlertBase):
     TYPE = "ERROR_RATE_ALERT"
 
@@ -72,9 +112,10 @@ class ErrorRateAlert(AlertBase):
             if not self.is_active:
                 self.status = ErrorRateAlert.ALERT
                 self.message = (
-                    "Error rate above threshold - {} ({:.0f}%)"
+                    "Error rate above threshold - {}{} ({:.0f}%)"
                     " errors in the last {} seconds"
                 ).format(
+                    self.approx(stats),
                     stats.traffic_by_status_code["500s"],
                     error_rate * 100,
                     self.reporting_window,
@@ -100,14 +141,18 @@ class DdosAlert(AlertBase):
             return
 
         most_popular_ip = max(stats.traffic_by_ip.keys(), key=stats.traffic_by_ip.get)
-        if stats.traffic_by_ip[most_popular_ip] >= self.visits_threshold:
+        if (
+            stats.traffic_by_ip[most_popular_ip]
+            >= self.visits_threshold * self.reporting_window
+        ):
             if not self.is_active:
                 self.status = DdosAlert.ALERT
                 self.message = (
-                    "{} requests above threshold - {} ({:.0f}%"
+                    "{} requests above threshold - {}{} ({:.0f}%"
                     " total traffic) in the last {} seconds"
                 ).format(
                     most_popular_ip,
+                    self.approx(stats),
                     stats.traffic_by_ip[most_popular_ip],
                     (stats.traffic_by_ip[most_popular_ip] / stats.traffic) * 100,
                     self.reporting_window,
@@ -118,3 +163,229 @@ class DdosAlert(AlertBase):
             self.status = DdosAlert.RECOVERED
             self.message = "User-specific requests returned to normal range"
             return self.as_message()
+
+
+class PrefixFloodAlert(AlertBase):
+    """Alert on requests of a whole prefix or named range, ie. a botnet's /16.
+
+    Addresses of a distributed flood may each stay below the DDoS threshold, their
+    prefix doesn't. We report the busiest of the most specific heavy prefixes.
+
+    """
+
+    TYPE = "PREFIX_FLOOD_ALERT"
+
+    def __init__(
+        self,
+        reporting_window: float,
+        visits_threshold: float,
+        prefixes: "PrefixTree",
+    ):
+        super().__init__()
+        self.reporting_window = reporting_window
+        self.visits_threshold = visits_threshold
+        self.prefixes = prefixes
+
+    def get_alert_status(self, stats: "MetricBucket"):
+        heavy = self.prefixes.get_heavy(self.visits_threshold * self.reporting_window)
+        if heavy:
+            if not self.is_active:
+                prefix = max(heavy, key=heavy.get)
+                self.status = PrefixFloodAlert.ALERT
+                self.message = (
+                    "{} requests above threshold - {}{} ({:.0f}%"
+                    " total traffic) in the last {} seconds"
+                ).format(
+                    prefix,
+                    self.approx(stats),
+                    heavy[prefix],
+                    heavy[prefix] / max(stats.traffic, 1) * 100,
+                    self.reporting_window,
+                )
+                return self.as_message()
+
+        elif self.is_active:
+            self.status = PrefixFloodAlert.RECOVERED
+            self.message = "Prefix-specific requests returned to normal range"
+            return self.as_message()
+
+
+class UniqueIpsAlert(AlertBase):
+    """Alert on a sudden jump in unique IPs.
+
+    Unique counts can't be derived from the running total, so we merge the sketches
+    of both halves of the window and compare the newer half against the older one.
+    Until we've been monitoring for a whole window the older half is incomplete, we
+    don't alert then.
+
+    """
+
+    TYPE = "UNIQUE_IPS_ALERT"
+    MIN_UNIQUE_IPS = 10
+
+    def __init__(
+        self,
+        reporting_window: float,
+        jump_ratio: float,
+        metrics: "MetricsAggregator",
+    ):
+        super().__init__()
+        self.reporting_window = reporting_window
+        self.jump_ratio = jump_ratio
+        self.metrics = metrics
+        self.started: Optional[float] = None
+
+    def get_alert_status(self, stats: "MetricBucket"):
+        now = self.metrics.get_current_timestamp()
+        if self.started is None:
+            self.started = now
+        if now - self.started < self.reporting_window:
+            return
+
+        midpoint = now - self.reporting_window / 2
+        older = self.metrics.get_cardinality(end=midpoint).unique_ips.count()
+        newer = self.metrics.get_cardinality(start=midpoint).unique_ips.count()
+
+        if older and newer >= max(older * self.jump_ratio, self.MIN_UNIQUE_IPS):
+            if not self.is_active:
+                self.status = UniqueIpsAlert.ALERT
+                self.message = (
+                    "Unique IPs jumped - ~{} in the last {} seconds"
+                    " against ~{} in the {} seconds before"
+                ).format(
+                    newer,
+                    self.reporting_window / 2,
+                    older,
+                    self.reporting_window / 2,
+                )
+                return self.as_message()
+
+        elif self.is_active:
+            self.status = UniqueIpsAlert.RECOVERED
+            self.message = "Unique IPs returned to normal range"
+            return self.as_message()
+
+
+class BaselineAlert(AlertBase):
+    """Alert on deviation from a baseline learnt from the traffic itself.
+
+    The baseline is fed once per bucket, as buckets leave the reporting window,
+    rather than with the overlapping window values we check: those are strongly
+    correlated from one check to the next and would make the baseline's variance
+    look much smaller than it is. While the alert is active buckets only count for
+    `ACTIVE_WEIGHT` of their time, we don't want an incident to quickly become the
+    new normal, but a lasting level shift eventually does. Until the baseline has
+    seen enough history we fall back to the fixed threshold, and keep feeding it in
+    full even if that threshold fires, otherwise starting above the threshold would
+    never let the baseline warm up.
+
+    Args:
+        threshold (float): Fixed threshold used while the baseline warms up.
+        baseline (Baseline): Baseline of the value.
+        mode (str): Either 'zscore' or 'ratio'.
+        deviation (float): Z-score/ratio to baseline above which we alert.
+
+    """
+
+    ACTIVE_WEIGHT = 0.1
+    RECOVERED_MESSAGE = "Value returned to normal range"
+
+    def __init__(
+        self,
+        reporting_window: float,
+        threshold: float,
+        baseline: "Baseline",
+        mode: str,
+        deviation: float,
+        metrics: "MetricsAggregator",
+    ):
+        super().__init__()
+        self.reporting_window = reporting_window
+        self.threshold = threshold
+        self.baseline = baseline
+        self.mode = mode
+        self.deviation = deviation
+        self.metrics = metrics
+
+    def get_value(self, stats: "MetricBucket", seconds: float) -> float:
+        raise NotImplementedError
+
+    def get_alert_message(self, stats: "MetricBucket", expected: str) -> str:
+        raise NotImplementedError
+
+    def add_bucket(self, bucket: "MetricBucket", bucket_size: float):
+        """Feed a bucket leaving the reporting window into the baseline."""
+        weight = (
+            self.ACTIVE_WEIGHT
+            if self.is_active and self.baseline.expected(bucket.timestamp)
+            else 1
+        )
+        if (
+            self.baseline.last_update is not None
+            and bucket.timestamp > self.baseline.last_update
+        ):
+            # Seconds without any bucket had no traffic, and no errors either
+            self.baseline.update(0, bucket.timestamp, weight)
+        self.baseline.update(
+            self.get_value(bucket, bucket_size), bucket.timestamp + bucket_size, weight
+        )
+
+    def get_alert_status(self, stats: "MetricBucket"):
+        now = self.metrics.get_current_timestamp()
+        value = self.get_value(stats, self.reporting_window)
+        deviation = self.baseline.deviation(value, now, self.mode)
+        is_anomaly = (
+            value >= self.threshold
+            if deviation is None
+            else deviation >= self.deviation
+        )
+
+        if is_anomaly:
+            if not self.is_active:
+                self.status = self.ALERT
+                self.message = self.get_alert_message(
+                    stats,
+                    "threshold"
+                    if deviation is None
+                    else "baseline ({} {:.1f})".format(self.mode, deviation),
+                )
+                return self.as_message()
+
+        elif self.is_active:
+            self.status = self.RECOVERED
+            self.message = self.RECOVERED_MESSAGE
+            return self.as_message()
+
+
+class TrafficBaselineAlert(BaselineAlert):
+    TYPE = TrafficAlert.TYPE
+    RECOVERED_MESSAGE = "Traffic returned to normal range"
+
+    def get_value(self, stats, seconds):
+        return stats.traffic / seconds
+
+    def get_alert_message(self, stats, expected):
+        return "Traffic above {} - {}{} hits in the last {} seconds".format(
+            expected, self.approx(stats), stats.traffic, self.reporting_window
+        )
+
+
+class ErrorRateBaselineAlert(BaselineAlert):
+    TYPE = ErrorRateAlert.TYPE
+    RECOVERED_MESSAGE = "Error rate returned to normal range"
+
+    def get_value(self, stats, seconds):
+        if not stats.traffic:
+            return 0.0
+        return stats.traffic_by_status_code.get("500s", 0) / stats.traffic
+
+    def get_alert_message(self, stats, expected):
+        return (
+            "Error rate above {} - {}{} ({:.0f}%) errors in the last {} seconds"
+        ).format(
+            expected,
+            self.approx(stats),
+            stats.traffic_by_status_code.get("500s", 0),
+            self.get_value(stats, self.reporting_window) * 100,
+            self.reporting_window,
+        )
@@ -0,0 +1,174 @@
+import json
+import math
+import os
+import time
+from typing import Dict, List, Optional
+
+ZSCORE = "zscore"
+RATIO = "ratio"
+
+
+class EwmaBaseline:
+    """Exponentially weighted moving mean and variance.
+
+    Updates are O(1) and the state is 3 floats, no matter how much history we've seen.
+    Weights decay with time rather than with the number of updates, so the baseline
+    doesn't depend on how often we happen to update it.
+
+    Args:
+        half_life (float): Seconds after which a value weighs half as much.
+
+    """
+
+    def __init__(
+        self,
+        half_life: float,
+        mean: float = 0.0,
+        variance: float = 0.0,
+        seen: float = 0.0,
+    ):
+        self.half_life = half_life
+        self.mean = mean
+        self.variance = variance
+        # Seconds of history the baseline is made of
+        self.seen = seen
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+    @property
+    def is_ready(self) -> bool:
+        return self.seen >= self.half_life
+
+    def update(self, value: float, dt: float):
+        if not self.seen:
+            self.mean = value
+
+        alpha = 1 - 0.5 ** (dt / self.half_life)
+        diff = value - self.mean
+        self.mean += alpha * diff
+        self.variance = (1 - alpha) * (self.variance + alpha * diff * diff)
+        self.seen += dt
+
+    def as_dict(self) -> Dict[str, float]:
+        return {"mean": self.mean, "variance": self.variance, "seen": self.seen}
+
+
+class Baseline:
+    """Baseline of a metric, optionally with a time-of-day profile.
+
+    The profile splits the day into `SLOT_SECONDS` slots, each one an EWMA of its own
+    fed only at that time of day. Once a slot has seen enough history it takes over
+    from the global EWMA, so a quiet night isn't compared against a busy afternoon.
+
+    Args:
+        half_life (float): Half-life of the global EWMA (seconds).
+        seasonal_days (float): Number of days a time-of-day slot remembers, 0
+            disables the profile.
+        path (str): File to persist the baseline to, and restore it from.
+
+    """
+
+    SLOT_SECONDS = 900
+    # Longer gaps between updates (ie. restarts) don't count as history
+    MAX_STEP = 60
+    SAVE_INTERVAL = 60
+    # Don't let a perfectly flat history turn any blip into an anomaly
+    MIN_RELATIVE_STD = 0.05
+
+    def __init__(
+        self, half_life: float, seasonal_days: float = 0, path: Optional[str] = None
+    ):
+        self.path = path
+        self.ewma = EwmaBaseline(half_life)
+        self.slots: List[EwmaBaseline] = (
+            [
+                EwmaBaseline(seasonal_days * self.SLOT_SECONDS)
+                for _ in range(86400 // self.SLOT_SECONDS)
+            ]
+            if seasonal_days
+            else []
+        )
+        self.last_update: Optional[float] = None
+        self.last_save = 0.0
+
+        if path and os.path.exists(path):
+            self.load()
+
+    def get_slot(self, timestamp: float) -> Optional[EwmaBaseline]:
+        if not self.slots:
+            return None
+
+        t = time.localtime(timestamp)
+        return self.slots[
+            (t.tm_hour * 3600 + t.tm_min * 60 + t.tm_sec) // self.SLOT_SECONDS
+        ]
+
+    def update(self, value: float, timestamp: float, weight: float = 1):
+        """Feed a value into the baseline.
+
+        Args:
+            weight (float): Share of the elapsed time the value counts for, values
+                seen during an incident only slowly move the baseline.
+
+        """
+        dt = (
+            min(timestamp - self.last_update, self.MAX_STEP)
+            if self.last_update is not None
+            else 0
+        )
+        self.last_update = timestamp
+        if dt <= 0 or weight <= 0:
+            return
+
+        self.ewma.update(value, dt * weight)
+        slot = self.get_slot(timestamp)
+        if slot:
+            slot.update(value, dt * weight)
+
+        if self.path and timestamp - self.last_save >= self.SAVE_INTERVAL:
+            self.save()
+            self.last_save = timestamp
+
+    def expected(self, timestamp: float) -> Optional[EwmaBaseline]:
+        """Get the baseline to compare against, None until we've seen enough."""
+        slot = self.get_slot(timestamp)
+        if slot and slot.is_ready:
+            return slot
+        return self.ewma if self.ewma.is_ready else None
+
+    def deviation(self, value: float, timestamp: float, mode: str) -> Optional[float]:
+        """Get the z-score or ratio of a value against the baseline."""
+        expected = self.expected(timestamp)
+        if not expected:
+            return None
+
+        if mode == RATIO:
+            return value / expected.mean if expected.mean else math.inf
+
+        std = max(expected.std, abs(expected.mean) * self.MIN_RELATIVE_STD, 1e-9)
+        return (value - expected.mean) / std
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "ewma": self.ewma.as_dict(),
+            "slots": [slot.as_dict() for slot in self.slots],
+        }
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.as_dict(), f)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        with open(self.path) as f:
+            state = json.load(f)
+
+        self.ewma = EwmaBaseline(self.ewma.half_life, **state["ewma"])
+        if len(state["slots"]) == len(self.slots):
+            self.slots = [
+                EwmaBaseline(slot.half_life, **slot_state)
+                for slot, slot_state in zip(self.slots, state["slots"])
+            ]
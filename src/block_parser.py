@@ -0,0 +1,285 @@
+import argparse
+import random
+import re
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .cardinality import Cardinality, HyperLogLog
+from .clock import VirtualClock
+from .endpoints import EndpointNormaliser
+from .log_parser import (
+    LOG_FORMAT,
+    ApacheFormatParser,
+    make_log_parser,
+    parse_apache_time,
+)
+from .metrics import MetricBucket, MetricsAggregator
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # type: ignore
+
+
+class BlockParser:
+    """Parse whole buffers of log lines into per-bucket aggregates.
+
+    A single regex scan finds every line along with its fields, from then on lines
+    only exist as columns of fields, counted per (bucket, value) in C. Timestamps are
+    decoded once per distinct second of the block, status classes all at once with
+    NumPy when it's installed. The endpoint normaliser, string decoding and sketches
+    only ever see distinct values.
+
+    Args:
+        format_string (str): Apache format string, JSON lines go through the per-line
+            parsers.
+        bucket_size (float): Bucket size of the aggregator buckets are added to.
+        use_numpy (bool): Decode with NumPy, defaults to whether it's installed.
+
+    """
+
+    # Requests are only needed for their path
+    FIELDS = {
+        **ApacheFormatParser.FIELDS,
+        "r": ("request", r"[^\s\"]* ?(?P<request>[^\s?\"]*)[^\"\n]*"),
+    }
+
+    def __init__(
+        self,
+        format_string: str = LOG_FORMAT,
+        normaliser: Optional[EndpointNormaliser] = None,
+        bucket_size: float = 1,
+        use_numpy: Optional[bool] = None,
+    ):
+        self.normalise = (normaliser or EndpointNormaliser()).normalise
+        self.bucket_size = bucket_size
+        self.use_numpy = np is not None if use_numpy is None else use_numpy
+
+        pattern, _ = ApacheFormatParser.compile_format(format_string, self.FIELDS)
+        self.regex = re.compile(("^" + pattern).encode(), re.MULTILINE)
+        self.columns = sorted(
+            self.regex.groupindex, key=self.regex.groupindex.__getitem__
+        )
+        self.time_column = self.columns.index("time_received")
+        self.user_column = next(
+            (
+                self.columns.index(name)
+                for name in ("remote_user", "remote_logname")
+                if name in self.columns
+            ),
+            None,
+        )
+
+    def get_bucket(self, timestamp: float) -> int:
+        return int(timestamp - timestamp % self.bucket_size)
+
+    def get_buckets(self, times: Sequence[bytes]) -> List[Optional[int]]:
+        """Get the bucket of every line, parsing each distinct timestamp once.
+
+        Returns:
+            list: Bucket of every line, None for the ones whose time can't be parsed.
+
+        """
+        buckets: Dict[bytes, Optional[int]] = {}
+        for value in dict.fromkeys(times):
+            try:
+                timestamp = parse_apache_time(value.decode()).timestamp()
+            except ValueError:
+                buckets[value] = None
+            else:
+                buckets[value] = self.get_bucket(timestamp)
+        return list(map(buckets.__getitem__, times))
+
+    def count_status_classes(
+        self, buckets: List[int], statuses: Sequence[bytes]
+    ) -> Dict[Tuple[int, str], int]:
+        if self.use_numpy:
+            classes = np.frombuffer(b"".join(statuses), dtype=np.uint8)[::3] - ord("0")
+            keys, counts = np.unique(
+                np.array(buckets, dtype=np.int64) * 10 + classes, return_counts=True
+            )
+            return {
+                (int(key // 10), f"{key % 10}00s"): int(count)
+                for key, count in zip(keys, counts)
+            }
+
+        result: Dict[Tuple[int, str], int] = Counter()
+        for (bucket, status), count in Counter(zip(buckets, statuses)).items():
+            result[bucket, f"{chr(status[0])}00s"] += count
+        return result
+
+    def parse(self, buffer: bytes) -> Tuple[List[MetricBucket], int]:
+        """Parse a buffer of whole lines.
+
+        Returns:
+            tuple: Buckets oldest first, and the number of lines which didn't match
+                the log format or whose time can't be parsed.
+
+        """
+        lines = buffer.split(b"\n")
+        matches = self.regex.findall(buffer)
+        skipped = len(lines) - lines.count(b"") - len(matches)
+        if not matches:
+            return [], skipped
+
+        line_buckets = self.get_buckets([match[self.time_column] for match in matches])
+        if None in line_buckets:
+            # Drop lines whose time can't be parsed, as ones not matching at all
+            matches = [
+                match
+                for match, bucket in zip(matches, line_buckets)
+                if bucket is not None
+            ]
+            skipped += len(line_buckets) - len(matches)
+            if not matches:
+                return [], skipped
+        buckets: List[int] = [bucket for bucket in line_buckets if bucket is not None]
+
+        columns = dict(zip(self.columns, zip(*matches)))
+        hosts, paths = columns["remote_host"], columns["request"]
+
+        result: Dict[int, MetricBucket] = {}
+        cardinalities: Dict[int, Cardinality] = {}
+        for bucket, count in Counter(buckets).items():
+            cardinalities[bucket] = Cardinality()
+            result[bucket] = MetricBucket(
+                bucket,
+                count,
+                cardinality=cardinalities[bucket],
+                response_sizes_by_endpoint={},
+            )
+
+        for (bucket, status_class), count in self.count_status_classes(
+            buckets, columns["status"]
+        ).items():
+            result[bucket].traffic_by_status_code[status_class] += count
+
+        endpoints = {
+            path: self.normalise(path.decode()) for path in dict.fromkeys(paths)
+        }
+        for (bucket, path), count in Counter(zip(buckets, paths)).items():
+            result[bucket].traffic_by_endpoint[endpoints[path]] += count
+        bucket_endpoints = list(map(endpoints.__getitem__, paths))
+
+        raw_sizes = columns.get("response_bytes") or [b"-"] * len(matches)
+        sizes = {
+            raw: 0 if raw == b"-" else int(raw) for raw in dict.fromkeys(raw_sizes)
+        }
+        for (bucket, endpoint, raw), count in Counter(
+            zip(buckets, bucket_endpoints, raw_sizes)
+        ).items():
+            result[bucket].add_response_size(endpoint, sizes[raw], count)
+
+        # Hash every distinct value once, buckets' sketches then only update registers
+        ips = {host: host.decode() for host in dict.fromkeys(hosts)}
+        ip_registers = {
+            host: HyperLogLog.get_register(ip, Cardinality.PRECISION)
+            for host, ip in ips.items()
+        }
+        for (bucket, host), count in Counter(zip(buckets, hosts)).items():
+            result[bucket].traffic_by_ip[ips[host]] += count
+            cardinalities[bucket].unique_ips.update(*ip_registers[host])
+
+        users = (
+            [match[self.user_column] for match in matches]
+            if self.user_column is not None
+            else [b"-"] * len(matches)
+        )
+        user_registers = {
+            user: HyperLogLog.get_register(user.decode(), Cardinality.PRECISION)
+            for user in dict.fromkeys(users)
+        }
+        for bucket, user in dict.fromkeys(zip(buckets, users)):
+            cardinalities[bucket].unique_users.update(*user_registers[user])
+
+        endpoint_registers = {
+            host: HyperLogLog.get_register(ip, Cardinality.ENDPOINT_PRECISION)
+            for host, ip in ips.items()
+        }
+        # First seen first, sketches are only kept for the first endpoints of a bucket
+        for bucket, endpoint, host in dict.fromkeys(
+            zip(buckets, bucket_endpoints, hosts)
+        ):
+            sketch = cardinalities[bucket].get_endpoint_sketch(endpoint)
+            if sketch:
+                sketch.update(*endpoint_registers[host])
+
+        return [result[bucket] for bucket in sorted(result)], skipped
+
+
+def make_block(lines: int, seconds: int = 600, start: float = 1525881600) -> bytes:
+    """Make a block of random log lines spread over `seconds`."""
+    rng = random.Random(0)
+    ips = [f"10.0.{i // 256}.{i % 256}" for i in range(500)]
+    users = ["king-arthur", "black-knight", "bridgekeeper", "lancelot", "sir-robin"]
+    endpoints = ["/api/user", "/", "/users/12/list", "/api/v2", "/list?page=2"]
+    statuses = ["200", "201", "301", "400", "404", "500"]
+    sizes = ["-", "234", "5120", "1048576"]
+    timestamps = [
+        time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime(start + second))
+        for second in range(seconds)
+    ]
+    return "".join(
+        '{} - {} [{}] "GET {} HTTP/1.0" {} {}\n'.format(
+            rng.choice(ips),
+            rng.choice(users),
+            timestamps[i * seconds // lines],
+            rng.choice(endpoints),
+            rng.choice(statuses),
+            rng.choice(sizes),
+        )
+        for i in range(lines)
+    ).encode()
+
+
+def benchmark(lines: int = 1000000, bucket_size: float = 1):
+    """Time the per-line path against block parsing, with and without NumPy."""
+    buffer = make_block(lines)
+    clock = VirtualClock(1525881600)
+
+    def make_aggregator() -> MetricsAggregator:
+        # A window wide enough for no bucket to expire, so both paths end up equal
+        return MetricsAggregator(86400, 10, bucket_size, 0.05, 2.5, clock=clock)
+
+    metrics = make_aggregator()
+    parse = make_log_parser(LOG_FORMAT)
+    began = time.perf_counter()
+    for line in buffer.decode().split("\n"):
+        if line:
+            metrics.add(parse(line))
+    per_line = time.perf_counter() - began
+    print(f"Per line: {per_line:.2f}s ({lines / per_line:,.0f} lines/s)")
+
+    for use_numpy in [False, True] if np is not None else [False]:
+        block_metrics = make_aggregator()
+        parser = BlockParser(LOG_FORMAT, bucket_size=bucket_size, use_numpy=use_numpy)
+        began = time.perf_counter()
+        block_metrics.add_buckets(parser.parse(buffer)[0])
+        elapsed = time.perf_counter() - began
+
+        assert block_metrics.get_stats() == metrics.get_stats()
+        print(
+            "Block{}: {:.2f}s ({:,.0f} lines/s, x{:.1f})".format(
+                " (NumPy)" if use_numpy else "",
+                elapsed,
+                lines / elapsed,
+                per_line / elapsed,
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark block parsing against the per-line path"
+    )
+    parser.add_argument("--lines", default=1000000, type=int, help="Lines per block")
+    parser.add_argument(
+        "--bucket-size", default=1, type=float, help="Bucket size (seconds)"
+    )
+    args = parser.parse_args()
+    benchmark(args.lines, args.bucket_size)
+
+
+if __name__ == "__main__":
+    main()
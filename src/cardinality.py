@@ -0,0 +1,147 @@
+import math
+from hashlib import blake2b
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+
+def get_hash(value: str) -> int:
+    """Get a stable 64 bit hash of a value.
+
+    Python's `hash` is salted per process, sketches built with it couldn't be
+    merged across processes or restarts.
+
+    """
+    return int.from_bytes(blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """Mergeable distinct count sketch.
+
+    Memory is fixed at 2^precision bytes no matter how many distinct values we see,
+    with a standard error of 1.04 / sqrt(2^precision), ie. ~3% at the default
+    precision of 10 (1KB).
+
+    """
+
+    def __init__(self, precision: int = 10, registers: bytearray = None):
+        self.precision = precision
+        self.registers = bytearray(1 << precision) if registers is None else registers
+
+    @staticmethod
+    def get_register(value: str, precision: int) -> Tuple[int, int]:
+        """Get the register a value goes to, and its rank."""
+        x = get_hash(value)
+        bits = 64 - precision
+        index, rest = x >> bits, x & ((1 << bits) - 1)
+        # Position of the leftmost 1 bit among the remaining bits
+        return index, bits - rest.bit_length() + 1
+
+    def add(self, value: str):
+        self.update(*self.get_register(value, self.precision))
+
+    def update(self, index: int, rank: int):
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        return HyperLogLog(
+            self.precision, bytearray(map(max, self.registers, other.registers))
+        )
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range correction - linear counting is more accurate there
+            estimate = m * math.log(m / zeros)
+
+        return round(estimate)
+
+
+class Cardinality:
+    """Unique visitors/users sketches of a single bucket.
+
+    We keep unique IPs per endpoint for at most `MAX_ENDPOINTS` endpoints per bucket
+    at lower precision, the first ones we see, the busiest endpoints almost always
+    show up among them. That keeps a bucket at ~4KB no matter the traffic.
+
+    Endpoints seen once a bucket is full are remembered in `partial_endpoints`, an
+    endpoint with lines missing from its sketch in any bucket of the window only gets
+    a lower bound of its unique IPs.
+
+    Note:
+        When sampling, only parsed lines end up in the sketches, so unique counts
+        are a lower bound.
+
+    """
+
+    MAX_ENDPOINTS = 16
+    PRECISION = 10
+    ENDPOINT_PRECISION = 7
+
+    def __init__(
+        self,
+        unique_ips: HyperLogLog = None,
+        unique_users: HyperLogLog = None,
+        unique_ips_by_endpoint: Dict[str, HyperLogLog] = None,
+        partial_endpoints: Set[str] = None,
+    ):
+        self.unique_ips = unique_ips or HyperLogLog(self.PRECISION)
+        self.unique_users = unique_users or HyperLogLog(self.PRECISION)
+        self.unique_ips_by_endpoint = unique_ips_by_endpoint or {}
+        self.partial_endpoints = partial_endpoints or set()
+
+    def add(self, data: Dict[str, str]):
+        self.unique_ips.add(data["remote_host"])
+        self.unique_users.add(data["remote_logname"])
+        sketch = self.get_endpoint_sketch(data["request_url_subpath"])
+        if sketch:
+            sketch.add(data["remote_host"])
+
+    def get_endpoint_sketch(self, endpoint: str) -> Optional[HyperLogLog]:
+        """Get the unique IPs sketch of an endpoint, None past `MAX_ENDPOINTS`."""
+        sketch = self.unique_ips_by_endpoint.get(endpoint)
+        if sketch is None:
+            if len(self.unique_ips_by_endpoint) >= self.MAX_ENDPOINTS:
+                self.partial_endpoints.add(endpoint)
+                return None
+            sketch = self.unique_ips_by_endpoint[endpoint] = HyperLogLog(
+                self.ENDPOINT_PRECISION
+            )
+        return sketch
+
+    def merge(self, other: "Cardinality") -> "Cardinality":
+        unique_ips_by_endpoint = dict(self.unique_ips_by_endpoint)
+        for endpoint, sketch in other.unique_ips_by_endpoint.items():
+            unique_ips_by_endpoint[endpoint] = (
+                unique_ips_by_endpoint[endpoint].merge(sketch)
+                if endpoint in unique_ips_by_endpoint
+                else sketch
+            )
+
+        return Cardinality(
+            self.unique_ips.merge(other.unique_ips),
+            self.unique_users.merge(other.unique_users),
+            unique_ips_by_endpoint,
+            self.partial_endpoints | other.partial_endpoints,
+        )
+
+    @staticmethod
+    def merge_all(cardinalities: Iterable["Cardinality"]) -> "Cardinality":
+        result: Optional[Cardinality] = None
+        for cardinality in cardinalities:
+            result = cardinality if result is None else result.merge(cardinality)
+        return result or Cardinality()
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "unique_ips": self.unique_ips.count(),
+            "unique_users": self.unique_users.count(),
+            "unique_ips_by_endpoint": {
+                endpoint: sketch.count()
+                for endpoint, sketch in self.unique_ips_by_endpoint.items()
+            },
+            "partial_unique_ips_by_endpoint": self.partial_endpoints,
+        }
@@ -0,0 +1,29 @@
+import time
+
+
+class Clock:
+    """Wall clock the monitor reads the time from and waits on."""
+
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+
+class VirtualClock(Clock):
+    """Clock which only moves when told to, so simulations run faster than real time.
+
+    Args:
+        start (float): Epoch the clock starts at.
+
+    """
+
+    def __init__(self, start: float):
+        self.now = start
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
@@ -4,11 +4,14 @@ from typing import Dict
 from colorama import Fore, Style
 
 from .alerts import AlertBase
+from .histogram import format_bytes
 
 
 class Display:
     TOP_IP = 5
     TOP_ENDPOINTS = 5
+    TOP_PREFIXES = 5
+    TOP_VHOSTS = 10
 
     def warn(self, msg, e):
         print(
@@ -28,9 +31,29 @@ class Display:
             " - total traffic in the last {time}s: {hits}".format(
                 time=reporting_window, hits=stats["traffic"]
             ),
-            " - by status code:",
+            " - unique ips: ~{ips}, unique users: ~{users}".format(
+                ips=stats["unique_ips"], users=stats["unique_users"]
+            ),
+            " - bandwidth: {rate}/s, response size p50: {p50}, p99: {p99},"
+            " max: {max}".format(
+                rate=format_bytes(stats["response_bytes"] / reporting_window),
+                **{
+                    key: format_bytes(value)
+                    for key, value in stats["response_size"].items()
+                },
+            ),
         ]
 
+        if stats["sample_rate"] < 1:
+            message.append(
+                " - sampled at {rate:.1%}, counts accurate to ±{error:.1%}"
+                " (95% confidence)".format(
+                    rate=stats["sample_rate"], error=stats["sample_error"]
+                )
+            )
+
+        message.append(" - by status code:")
+
         for status_code, hits in sorted(stats["traffic_by_status_code"].items()):
             message.append(f"    {status_code} - {hits}")
 
@@ -43,7 +66,29 @@ class Display:
         ):
             if i == Display.TOP_ENDPOINTS:
                 break
-            message.append(f"    {endpoint} - {hits}")
+            unique_ips = stats["unique_ips_by_endpoint"].get(endpoint)
+            # Lines of the endpoint were missing from its sketch in some buckets
+            partial = endpoint in stats.get("partial_unique_ips_by_endpoint", ())
+            response_size = stats.get("response_size_by_endpoint", {}).get(endpoint)
+            details = [
+                *(
+                    [f"{'at least ' if partial else ''}~{unique_ips} unique ips"]
+                    if unique_ips is not None
+                    else []
+                ),
+                "{}/s".format(
+                    format_bytes(
+                        stats["response_bytes_by_endpoint"].get(endpoint, 0)
+                        / reporting_window
+                    )
+                ),
+                *(
+                    [f"p99 {format_bytes(response_size['p99'])}"]
+                    if response_size
+                    else []
+                ),
+            ]
+            message.append(f"    {endpoint} - {hits} ({', '.join(details)})")
 
         message.append(f" - TOP {Display.TOP_IP} by ip:".format())
         for i, (ip, hits) in enumerate(
@@ -55,6 +100,30 @@ class Display:
                 break
             message.append(f"    {ip} - {hits}")
 
+        if "traffic_by_prefix" in stats:
+            message.append(f" - TOP {Display.TOP_PREFIXES} by prefix:")
+            for prefix, hits in sorted(
+                stats["traffic_by_prefix"].items(),
+                key=lambda hits_per_prefix: -hits_per_prefix[1],
+            )[: Display.TOP_PREFIXES]:
+                message.append(f"    {prefix} - {hits}")
+
+        print("\n".join(message), flush=True)
+
+    def send_vhost_stats(self, stats_by_vhost: Dict[str, Dict]):
+        message = [f" - TOP {Display.TOP_VHOSTS} by vhost:"]
+        for vhost, stats in sorted(
+            stats_by_vhost.items(), key=lambda vhost_stats: -vhost_stats[1]["traffic"]
+        )[: Display.TOP_VHOSTS]:
+            errors = stats["traffic_by_status_code"].get("500s", 0)
+            message.append(
+                "    {vhost} - {hits} ({errors:.0%} 500s)".format(
+                    vhost=vhost,
+                    hits=stats["traffic"],
+                    errors=errors / stats["traffic"] if stats["traffic"] else 0,
+                )
+            )
+
         print("\n".join(message), flush=True)
 
     def send_alert(self, alert: Dict[str, str]):
@@ -0,0 +1,164 @@
+import re
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .clock import Clock
+
+UUID_SEGMENT = re.compile(
+    r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$"
+)
+HEX_SEGMENT = re.compile(r"^(?=.*[0-9])[0-9a-fA-F]{8,}$")
+# Section of every path past `max_sections`
+OTHER_SECTION = "/{other}"
+
+
+def collapse_segment(segment: str) -> str:
+    """Replace IDs in a path segment with a placeholder.
+
+    Example:
+        '12345' => '{id}',
+        '3f2504e0-4f89-11d3-9a0c-0305e82c3301' => '{uuid}',
+        '5f3a9c0d1e2b' => '{hex}',
+        'orders' => 'orders',
+
+    """
+    if segment.isdigit():
+        return "{id}"
+    if UUID_SEGMENT.match(segment):
+        return "{uuid}"
+    if HEX_SEGMENT.match(segment):
+        return "{hex}"
+    return segment
+
+
+class RouteNode:
+    __slots__ = ("children", "wildcard", "rest", "route")
+
+    def __init__(self):
+        self.children: Dict[str, RouteNode] = {}
+        self.wildcard: Optional[RouteNode] = None
+        # Route of a trailing `**`, matching any number of remaining segments
+        self.rest: Optional[str] = None
+        self.route: Optional[str] = None
+
+
+class EndpointNormaliser:
+    """Map raw request paths to the endpoint sections we aggregate traffic by.
+
+    Paths matching one of the explicit routes map to that route, ie. with
+    `/users/{id}/orders` configured `/users/12345/orders` maps to
+    `/users/{id}/orders`. Route segments are either literals, `*`/`{name}` matching
+    a single segment, or a trailing `**` matching the rest of the path.
+
+    Any other path keeps its first `depth` segments, with numeric, UUID and hex IDs
+    collapsed into placeholders, so a single misbehaving client can't blow up the
+    number of endpoints we keep track of. Scanners probing for `/wp-login.php`,
+    `/.env` and random slugs still make up a new section per path, once we've seen
+    `max_sections` of them within `window` seconds every new one falls into
+    `/{other}`. Sections not seen for `window` seconds make room for new ones, so
+    endpoints showing up once the noise is gone get their own again.
+
+    Routes are compiled into a trie, and sections of raw paths are kept in a LRU
+    cache, most paths repeat over and over again.
+
+    Args:
+        routes (list): Explicit route patterns.
+        depth (int): Number of path segments making up a section.
+        collapse_ids (bool): Whether to collapse IDs into placeholders.
+        cache_size (int): Number of raw paths we keep the normalised result for.
+        max_sections (int): Number of distinct sections, on top of explicit routes,
+            before new ones fall into `/{other}`, None for no limit.
+        window (float): Seconds a section counts towards `max_sections` after it was
+            last seen, ie. the reporting window, None to keep it forever.
+        clock (Clock): Clock sections are timed with.
+
+    """
+
+    def __init__(
+        self,
+        routes: Iterable[str] = (),
+        depth: int = 1,
+        collapse_ids: bool = True,
+        cache_size: int = 65536,
+        max_sections: Optional[int] = 1000,
+        window: Optional[float] = None,
+        clock: Optional[Clock] = None,
+    ):
+        self.depth = depth
+        self.collapse_ids = collapse_ids
+        self.max_sections = max_sections
+        self.window = window
+        self.clock = clock or Clock()
+        # Section => when it was last seen, least recently seen first
+        self.sections: "OrderedDict[str, float]" = OrderedDict()
+        self.root = RouteNode()
+        for route in routes:
+            self.add_route(route)
+
+        self.get_section = lru_cache(maxsize=cache_size)(self._get_section)
+
+    def add_route(self, route: str):
+        node = self.root
+        segments = route.strip("/").split("/") if route.strip("/") else []
+        for i, segment in enumerate(segments):
+            if segment == "**" and i == len(segments) - 1:
+                node.rest = route
+                return
+
+            if segment == "*" or (segment.startswith("{") and segment.endswith("}")):
+                node.wildcard = node.wildcard or RouteNode()
+                node = node.wildcard
+            else:
+                node = node.children.setdefault(segment, RouteNode())
+        node.route = route
+
+    def match_route(self, node: RouteNode, segments: List[str], i: int = 0):
+        """Find the route of a path, literals take precedence over wildcards."""
+        if i == len(segments):
+            return node.route or node.rest
+
+        child = node.children.get(segments[i])
+        route = child and self.match_route(child, segments, i + 1)
+        if not route and node.wildcard:
+            route = self.match_route(node.wildcard, segments, i + 1)
+        return route or node.rest
+
+    def _get_section(self, path: str) -> Tuple[str, bool]:
+        """Get the section of a path, and whether it's an explicit route."""
+        segments = [segment for segment in path.split("/") if segment]
+        route = self.match_route(self.root, segments)
+        if route:
+            return route, True
+
+        segments = segments[: self.depth]
+        if self.collapse_ids:
+            segments = [collapse_segment(segment) for segment in segments]
+        return "/" + "/".join(segments), False
+
+    def normalise(self, path: str) -> str:
+        section, is_route = self.get_section(path)
+        if is_route or self.max_sections is None:
+            return section
+
+        now = self.clock.time()
+        sections = self.sections
+        if section in sections:
+            sections[section] = now
+            sections.move_to_end(section)
+            return section
+
+        if len(sections) >= self.max_sections:
+            oldest, last_seen = next(iter(sections.items()))
+            if self.window is None or now - last_seen < self.window:
+                return OTHER_SECTION
+            del sections[oldest]
+        sections[section] = now
+        return section
+
+
+def load_routes(path: str) -> List[str]:
+    """Load route patterns from a file, one per line, `#` starts a comment."""
+    with open(path) as f:
+        lines = (line.split("#", 1)[0].strip() for line in f)
+        return [line for line in lines if line]
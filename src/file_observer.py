@@ -4,7 +4,7 @@ import subprocess
 import sys
 import time
 from threading import Thread
-from typing import List, Type
+from typing import Dict, List, Type
 
 from watchdog.events import FileModifiedEvent, FileSystemEventHandler
 from watchdog.observers import Observer
@@ -44,36 +44,81 @@ class LogsFileHandler(FileSystemEventHandler):
             list: Lines from self.file_path, splitted on new line white character.
 
         """
-        res = str(subprocess.check_output(["tail", f"-n {n}", self.file_path]), "utf-8")
-        return res.split("\n")
+        return str(self.get_last_n_bytes(n), "utf-8").split("\n")
+
+    def get_last_n_bytes(self, n: int) -> bytes:
+        return subprocess.check_output(["tail", f"-n {n}", self.file_path])
 
     def on_modified(self, event: Type[FileModifiedEvent]):
-        if not event.is_directory and event.src_path.startswith(self.file_path):
+        if not event.is_directory:
             previous_length, current_length = (
                 self.current_length,
                 self.get_file_length(),
             )
             n = current_length - previous_length
             if n:
-                self.controller.add_lines(self.get_last_n_lines(n))
+                if getattr(self.controller, "block_mode", False):
+                    self.controller.add_block(self.get_last_n_bytes(n))
+                else:
+                    self.controller.add_lines(self.get_last_n_lines(n))
                 self.current_length = current_length
 
 
+class FilesHandler(FileSystemEventHandler):
+    """Dispatch events to the handler of the modified file, ignore other files."""
+
+    def __init__(self, handlers: Dict[str, LogsFileHandler]):
+        self.handlers = {
+            os.path.abspath(path): handler for path, handler in handlers.items()
+        }
+
+    def on_modified(self, event: Type[FileModifiedEvent]):
+        handler = self.handlers.get(os.path.abspath(event.src_path))
+        if handler:
+            handler.on_modified(event)
+
+
 class FileObserver:
     def __init__(self, file_path, controller):
         self.file_path = file_path
         self.controller = controller
 
-        self._watch_thread = Thread(target=self.watch)
+        self._watch_thread = Thread(target=self.watch, name="file-observer")
         self._watch_thread.daemon = True
 
     def start(self):
         self._watch_thread.start()
 
-    def watch(self):
-        event_handler = LogsFileHandler(self.file_path, self.controller)
+    def make_handlers(self) -> Dict[str, LogsFileHandler]:
+        return {self.file_path: LogsFileHandler(self.file_path, self.controller)}
+
+    def make_observer(self) -> Observer:
+        """Schedule a watchdog observer over the parent directories of the files.
+
+        Handlers, and so parsing and aggregation, run on the observer's own threads
+        rather than on ours: they're named as well, so they're told apart in
+        profiles.
+
+        """
+        handlers = self.make_handlers()
+        event_handler = FilesHandler(handlers)
         observer = Observer()
-        observer.schedule(event_handler, os.path.dirname(self.file_path), recursive=True)
+        observer.name = "file-observer-dispatch"
+        for directory in {os.path.dirname(os.path.abspath(path)) for path in handlers}:
+            observer.schedule(event_handler, directory, recursive=False)
+        for emitter in observer.emitters:
+            emitter.name = f"file-observer-emitter:{emitter.watch.path}"
+        return observer
+
+    def watch(self):
+        """Watch log files for modifications.
+
+        We watch parent directories of the files non-recursively, one watch per
+        directory no matter how many files it holds, so events of unrelated files
+        in sub-directories never reach us.
+
+        """
+        observer = self.make_observer()
         observer.start()
         try:
             while True:
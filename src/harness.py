@@ -0,0 +1,289 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+from itertools import product
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from watchdog.events import FileModifiedEvent
+
+from .alerts import AlertBase, DdosAlert, TrafficAlert
+from .clock import VirtualClock
+from .display import Display
+from .file_observer import FilesHandler
+from .http_monitor import HTTPMonitor
+
+# 09/May/2018:16:00:00 +0000, any fixed epoch keeps runs reproducible
+START_TIME = 1525881600
+
+
+class Phase(NamedTuple):
+    duration: int
+    rate: float
+    incident: bool = False
+    # Requests/second from a single IP, on top of `rate`
+    attacker_rate: float = 0
+
+
+class Scenario(NamedTuple):
+    name: str
+    phases: List[Phase]
+    alert_type: str
+    ips: int = 200
+
+
+SCENARIOS = {
+    "traffic-burst": Scenario(
+        "traffic-burst",
+        [Phase(180, 5), Phase(90, 40, incident=True), Phase(240, 5)],
+        TrafficAlert.TYPE,
+    ),
+    "ddos": Scenario(
+        "ddos",
+        [Phase(180, 5), Phase(90, 5, incident=True, attacker_rate=6), Phase(240, 5)],
+        DdosAlert.TYPE,
+    ),
+}
+
+
+class RecordingDisplay(Display):
+    """Display keeping messages along with the (virtual) time they were sent at."""
+
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        self.alerts: List[Tuple[float, Dict[str, str]]] = []
+        self.stats: List[float] = []
+        self.warnings = 0
+
+    def warn(self, msg, e):
+        self.warnings += 1
+
+    def send_stats(self, stats, reporting_window: float):
+        self.stats.append(self.clock.time())
+
+    def send_alert(self, alert: Dict[str, str]):
+        self.alerts.append((self.clock.time(), alert))
+
+
+class Result(NamedTuple):
+    scenario: str
+    alert_monitoring_window: float
+    bucket_size: float
+    detection_delay: Optional[float]
+    recovery_delay: Optional[float]
+    false_positives: int
+    cpu_per_second: float
+    wall_time: float
+
+
+def make_lines(
+    scenario: Scenario, phase: Phase, now: float, rng: random.Random
+) -> List[str]:
+    """Make the log lines of a single second of a phase."""
+    hits = int(phase.rate) + (rng.random() < phase.rate % 1)
+    timestamp = time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime(now))
+    ips = [
+        "10.0.{}.{}".format(*divmod(rng.randrange(scenario.ips), 256))
+        for _ in range(hits)
+    ] + ["192.0.2.1"] * int(phase.attacker_rate)
+    return [
+        f'{ip} - user [{timestamp}] "GET /api/user HTTP/1.0" 200 234\n' for ip in ips
+    ]
+
+
+def run(
+    scenario: Scenario,
+    alert_monitoring_window: float,
+    bucket_size: float,
+    reporting_window: float = 120,
+    alert_threshold: float = 10,
+    alert_error_rate: float = 0.05,
+    ddos_threshold: float = 2.5,
+    seed: int = 0,
+) -> Result:
+    """Drive a scenario through FileObserver -> HTTPMonitor -> Display.
+
+    Instead of sleeping, we jump the virtual clock straight to the next event: a
+    second of traffic being written to the log, an alerts check or a stats report.
+
+    Modification events go through the handlers `FileObserver` watches with, only
+    watchdog's own threads are bypassed, the events they'd deliver are dispatched
+    straight away.
+
+    """
+    began = time.perf_counter()
+    rng = random.Random(seed)
+    clock = VirtualClock(START_TIME)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "access.log")
+        open(path, "w").close()
+
+        monitor = HTTPMonitor(
+            path,
+            reporting_window,
+            alert_threshold,
+            bucket_size,
+            alert_error_rate,
+            alert_monitoring_window,
+            ddos_threshold,
+            clock=clock,
+        )
+        display = monitor.display = RecordingDisplay(clock)
+        handler = FilesHandler(monitor.file_observer.make_handlers())
+
+        incident_start: Optional[float] = None
+        incident_end: Optional[float] = None
+        next_alerts = START_TIME + alert_monitoring_window
+        next_stats = START_TIME + reporting_window
+        cpu = 0.0
+
+        for phase in scenario.phases:
+            if phase.incident and incident_start is None:
+                incident_start = clock.time()
+
+            phase_end = clock.time() + phase.duration
+            next_write = clock.time()
+            while next_write < phase_end:
+                clock.now = min(next_write, next_alerts, next_stats)
+                before = os.times()
+
+                if clock.now == next_write:
+                    with open(path, "a") as f:
+                        f.writelines(make_lines(scenario, phase, clock.now, rng))
+                    handler.on_modified(FileModifiedEvent(path))
+                    next_write += 1
+                if clock.now == next_alerts:
+                    monitor.report_alerts_once()
+                    next_alerts += alert_monitoring_window
+                if clock.now == next_stats:
+                    monitor.report_metrics_once()
+                    next_stats += reporting_window
+
+                after = os.times()
+                # Include `wc`/`tail` the file handler runs in child processes
+                cpu += sum(after[:4]) - sum(before[:4])
+
+            if phase.incident:
+                incident_end = phase_end
+
+        if incident_start is None or incident_end is None:
+            raise ValueError(f"Scenario {scenario.name} has no incident phase.")
+
+        # Keep checking alerts until the incident left the reporting window
+        while next_alerts <= incident_end + 2 * reporting_window:
+            clock.now = next_alerts
+            monitor.report_alerts_once()
+            next_alerts += alert_monitoring_window
+
+        duration = sum(phase.duration for phase in scenario.phases)
+
+    return Result(
+        scenario.name,
+        alert_monitoring_window,
+        bucket_size,
+        *get_delays(display.alerts, scenario.alert_type, incident_start, incident_end),
+        cpu / duration,
+        time.perf_counter() - began,
+    )
+
+
+def get_delays(
+    alerts: List[Tuple[float, Dict[str, str]]],
+    alert_type: str,
+    incident_start: float,
+    incident_end: float,
+) -> Tuple[Optional[float], Optional[float], int]:
+    """Get detection delay, recovery delay and number of false positives.
+
+    Any alert of another type, or fired before the incident started, is a false
+    positive.
+
+    """
+    detection = recovery = None
+    false_positives = 0
+    for timestamp, alert in alerts:
+        expected = alert["type"] == alert_type and timestamp >= incident_start
+        if alert["status"] == AlertBase.ALERT:
+            if not expected:
+                false_positives += 1
+            elif detection is None:
+                detection = timestamp - incident_start
+        elif expected and detection is not None and recovery is None:
+            recovery = timestamp - incident_end
+
+    return detection, recovery, false_positives
+
+
+def print_results(results: List[Result]):
+    header = (
+        "scenario",
+        "window",
+        "bucket",
+        "detection",
+        "recovery",
+        "false +",
+        "cpu ms/s",
+        "wall s",
+    )
+    print("  ".join(f"{column:>13}" for column in header))
+    for result in results:
+        row = (
+            result.scenario,
+            f"{result.alert_monitoring_window:g}s",
+            f"{result.bucket_size:g}s",
+            "-" if result.detection_delay is None else f"{result.detection_delay:g}s",
+            "-" if result.recovery_delay is None else f"{result.recovery_delay:g}s",
+            result.false_positives,
+            f"{result.cpu_per_second * 1000:.2f}",
+            f"{result.wall_time:.2f}",
+        )
+        print("  ".join(f"{value:>13}" for value in row), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure alert latency and accuracy on a virtual clock"
+    )
+    parser.add_argument(
+        "--scenario",
+        nargs="+",
+        default=list(SCENARIOS),
+        choices=list(SCENARIOS),
+        help="Traffic scenarios to run",
+    )
+    parser.add_argument(
+        "--alert-monitoring-window",
+        nargs="+",
+        default=[1, 5, 10],
+        type=float,
+        help="Alert monitoring windows to try (seconds)",
+    )
+    parser.add_argument(
+        "--bucket-size",
+        nargs="+",
+        default=[1, 5],
+        type=float,
+        help="Bucket sizes to try (seconds)",
+    )
+    parser.add_argument(
+        "--reporting-window",
+        default=120,
+        type=float,
+        help="Reporting window (seconds)",
+    )
+    args = parser.parse_args()
+
+    print_results(
+        [
+            run(SCENARIOS[name], window, bucket_size, args.reporting_window)
+            for name, window, bucket_size in product(
+                args.scenario, args.alert_monitoring_window, args.bucket_size
+            )
+        ]
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -19,7 +19,32 @@ def validate_path(path):
     return path
 
 
-def parse_command_line():
+def parse_prefix_lengths(value):
+    try:
+        lengths = tuple(sorted(int(length) for length in value.split(",")))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Prefix lengths should be integers.")
+
+    if not all(0 < length <= 128 for length in lengths):
+        raise argparse.ArgumentTypeError("Prefix lengths should be within 1 and 128.")
+    return lengths
+
+
+# Options of a single file monitor, `ShardedMonitor` doesn't support them
+SINGLE_FILE_OPTIONS = [
+    "sampling_lag_target",
+    "history_path",
+    "baseline_mode",
+    "baseline_deviation",
+    "baseline_half_life",
+    "baseline_seasonal_days",
+    "baseline_path",
+    "block_mode",
+    "give_me_traffic",
+]
+
+
+def parse_command_line(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "-p",
@@ -28,6 +53,20 @@ def parse_command_line():
         type=validate_path,
         help="Path to the log file",
     )
+    parser.add_argument(
+        "--paths",
+        nargs="+",
+        default=None,
+        help="Log files or globs (ie. '/var/log/vhosts/*.log') to monitor together,"
+        " overrides --path, single file options (sampling, history, baselines, block"
+        " mode) aren't supported",
+    )
+    parser.add_argument(
+        "--workers",
+        default=None,
+        type=int,
+        help="Number of worker processes to shard --paths across (default: CPUs)",
+    )
     parser.add_argument(
         "-r",
         "--reporting-window",
@@ -47,7 +86,33 @@ def parse_command_line():
         "--ddos-threshold",
         default=2.5,
         type=float,
-        help="DDOS alert threshold (requests/seconds)",
+        help="DDOS alert threshold of a single IP (requests/seconds, averaged over"
+        " the reporting window)",
+    )
+    parser.add_argument(
+        "--bandwidth-threshold",
+        default=None,
+        type=float,
+        help="Bandwidth alert threshold (bytes/seconds), disabled by default",
+    )
+    parser.add_argument(
+        "--prefix-threshold",
+        default=None,
+        type=float,
+        help="Alert threshold of a /16, /24 or named range (requests/seconds),"
+        " disabled by default",
+    )
+    parser.add_argument(
+        "--ipv6-prefixes",
+        default="32,48,64",
+        type=parse_prefix_lengths,
+        help="IPv6 prefix lengths to aggregate traffic by, ie. 48,64",
+    )
+    parser.add_argument(
+        "--ip-ranges",
+        default=None,
+        help="File with named CIDR ranges to aggregate traffic by, `<cidr> [name]`"
+        " per line",
     )
     parser.add_argument(
         "-w",
@@ -70,11 +135,107 @@ def parse_command_line():
         type=float,
         help="High errors alert threshold (ko/(ok + ko))",
     )
+    parser.add_argument(
+        "-u",
+        "--unique-ips-jump",
+        default=2,
+        type=float,
+        help="Unique IPs alert threshold (newer / older half of the reporting window)",
+    )
+    parser.add_argument(
+        "-s",
+        "--sampling-lag-target",
+        default=None,
+        type=float,
+        help="Shed load by sampling log lines, keeping ingestion lag below (seconds)",
+    )
+    parser.add_argument(
+        "--endpoint-depth",
+        default=1,
+        type=int,
+        help="Number of path segments making up an endpoint section",
+    )
+    parser.add_argument(
+        "--endpoint-routes",
+        default=None,
+        help="File with route patterns to group endpoints by, ie. /users/{id}/orders",
+    )
+    parser.add_argument(
+        "--max-endpoints",
+        default=1000,
+        type=int,
+        help="Distinct endpoint sections we keep track of, new ones past it are"
+        " counted as /{other}",
+    )
+    parser.add_argument(
+        "--log-format",
+        default="auto",
+        help="Log format: auto (detected from the first lines), clf, common, combined,"
+        " json or an Apache format string",
+    )
+    parser.add_argument(
+        "--block-mode",
+        action="store_true",
+        help="Parse whatever was appended to the log as a single block, rather than"
+        " line by line, can't be used with --sampling-lag-target",
+    )
+    parser.add_argument(
+        "--baseline-mode",
+        default=None,
+        choices=["zscore", "ratio"],
+        help="Alert on traffic/error rate deviating from a learnt baseline",
+    )
+    parser.add_argument(
+        "--baseline-deviation",
+        default=3,
+        type=float,
+        help="Z-score or ratio to baseline above which we alert",
+    )
+    parser.add_argument(
+        "--baseline-half-life",
+        default=3600,
+        type=float,
+        help="Half-life of the baseline history (seconds)",
+    )
+    parser.add_argument(
+        "--baseline-seasonal-days",
+        default=0,
+        type=float,
+        help="Days of history kept in the time-of-day profile, 0 disables it",
+    )
+    parser.add_argument(
+        "--baseline-path",
+        default=None,
+        help="Directory to persist baselines to across restarts",
+    )
+    parser.add_argument(
+        "--history-path",
+        default=None,
+        help="Directory to store buckets in once they leave the reporting window",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        default=None,
+        help="Enable SIGUSR1 (sampling profiler) and SIGUSR2 (allocations) hooks,"
+        " writing reports to this directory",
+    )
     parser.add_argument(
         "-g", "--give-me-traffic", action="store_true", help="Simulate traffic"
     )
 
-    return parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.paths:
+        unsupported = [
+            "--" + dest.replace("_", "-")
+            for dest in SINGLE_FILE_OPTIONS
+            if getattr(args, dest) != parser.get_default(dest)
+        ]
+        if unsupported:
+            parser.error(f"{', '.join(unsupported)} can't be used with --paths")
+    if args.block_mode and args.sampling_lag_target is not None:
+        # Blocks are aggregated whole, there's no line to skip
+        parser.error("--sampling-lag-target can't be used with --block-mode")
+    return args
 
 
 def simulate_traffic(file_path: str):
@@ -0,0 +1,95 @@
+import operator
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+from typing import Dict
+
+
+def format_bytes(value: float) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(value) < 1024:
+            break
+        value /= 1024
+    else:
+        unit = "TB"
+    return f"{value:.0f}{unit}" if unit == "B" else f"{value:.1f}{unit}"
+
+
+class LogLinearHistogram:
+    """Mergeable histogram of non-negative integers, ie. response sizes.
+
+    Like HDR histograms, buckets are linear within each power of 2: values below
+    2^SUB_BUCKET_BITS get a bucket each, larger ones share 2^SUB_BUCKET_BITS buckets
+    per power of 2, so any value is known to within 1/16th. Memory is a fixed array
+    of ~2KB no matter the values, and histograms add up and subtract element-wise,
+    so a running total can drop expired buckets.
+
+    """
+
+    SUB_BUCKET_BITS = 4
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+    # Larger values (64GB) are counted as the largest one
+    MAX_BITS = 36
+    MAX_VALUE = (1 << MAX_BITS) - 1
+    SIZE = (MAX_BITS - SUB_BUCKET_BITS + 1) << SUB_BUCKET_BITS
+
+    def __init__(self, counts: array = None):
+        self.counts = array("I", bytes(4 * self.SIZE)) if counts is None else counts
+
+    @classmethod
+    def get_index(cls, value: int) -> int:
+        value = min(value, cls.MAX_VALUE)
+        if value < cls.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - cls.SUB_BUCKET_BITS - 1
+        return ((shift + 1) << cls.SUB_BUCKET_BITS) + (value >> shift) - cls.SUB_BUCKETS
+
+    @classmethod
+    def get_value(cls, index: int) -> int:
+        """Get the highest value counted in a bucket."""
+        if index < cls.SUB_BUCKETS:
+            return index
+        shift = (index >> cls.SUB_BUCKET_BITS) - 1
+        sub_bucket = (index & (cls.SUB_BUCKETS - 1)) + cls.SUB_BUCKETS
+        return ((sub_bucket + 1) << shift) - 1
+
+    def add(self, value: int, count: int = 1):
+        self.counts[self.get_index(value)] += count
+
+    def merge(self, other: "LogLinearHistogram"):
+        """Add another histogram's counts in place."""
+        self.counts = (self + other).counts
+
+    def __add__(self, other: "LogLinearHistogram") -> "LogLinearHistogram":
+        counts = map(operator.add, self.counts, other.counts)
+        return LogLinearHistogram(array("I", counts))
+
+    def __sub__(self, other: "LogLinearHistogram") -> "LogLinearHistogram":
+        counts = map(operator.sub, self.counts, other.counts)
+        return LogLinearHistogram(array("I", counts))
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts)
+
+    def percentile(self, q: float) -> int:
+        cumulative = list(accumulate(self.counts))
+        if not cumulative[-1]:
+            return 0
+        return self.get_value(
+            bisect_left(cumulative, max(1, round(q * cumulative[-1])))
+        )
+
+    @property
+    def max(self) -> int:
+        for index in range(len(self.counts) - 1, -1, -1):
+            if self.counts[index]:
+                return self.get_value(index)
+        return 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
@@ -0,0 +1,447 @@
+import argparse
+import json
+import mmap
+import os
+import shutil
+import time
+from array import array
+from threading import RLock
+from typing import Dict, List, Optional, Tuple
+
+from .metrics import MetricBucket
+
+STATUS_CODES = ["100s", "200s", "300s", "400s", "500s"]
+KEYED_COLUMNS = {"endpoints": "traffic_by_endpoint", "ips": "traffic_by_ip"}
+
+
+class Segment:
+    """Columnar files of all buckets falling into a single time span.
+
+    Every column is an append-only file, so a bucket is appended without rewriting
+    anything:
+
+    - `timestamp`, `traffic`, `sampled` - one int64 per bucket
+    - `status` - one int64 per status class per bucket
+    - `<key>.keys` - dictionary of IPs/endpoints, one per line, ids are line numbers
+    - `<key>.pairs` - (id, count) uint32 pairs of all buckets one after another
+    - `<key>.offsets` - int64 end offset of every bucket's pairs
+
+    The `timestamp` column is written last, its length is the number of complete
+    buckets in the segment. Whatever a crash left past it in other columns is cut
+    off before we append to the segment again.
+
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.start = meta["start"]
+        self.end = meta["end"]
+        self.resolution = meta["resolution"]
+
+    @staticmethod
+    def create(path: str, start: int, end: int, resolution: float) -> "Segment":
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, "meta.json")
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({"start": start, "end": end, "resolution": resolution}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+        return Segment(path)
+
+    def column_path(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def read_keys(self, name: str) -> List[str]:
+        try:
+            with open(self.column_path(f"{name}.keys"), encoding="utf-8") as f:
+                return f.read().split("\n")[:-1]
+        except FileNotFoundError:
+            return []
+
+    def map_column(self, name: str, typecode: str) -> memoryview:
+        """Memory-map a column, only pages we actually touch get read from disk."""
+        try:
+            with open(self.column_path(name), "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                size -= size % array(typecode).itemsize
+                if not size:
+                    return memoryview(b"").cast(typecode)
+                mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+                return memoryview(mapped).cast(typecode)
+        except FileNotFoundError:
+            return memoryview(b"").cast(typecode)
+
+    def repair(self):
+        """Truncate columns to the buckets whose `timestamp` was written."""
+        n = len(self.map_column("timestamp", "q"))
+        sizes = {
+            "timestamp": 8 * n,
+            "traffic": 8 * n,
+            "sampled": 8 * n,
+            "status": 8 * n * len(STATUS_CODES),
+        }
+        for name in KEYED_COLUMNS:
+            offsets = self.map_column(f"{name}.offsets", "q")
+            sizes[f"{name}.offsets"] = 8 * n
+            # (id, count) pairs of uint32
+            sizes[f"{name}.pairs"] = 8 * offsets[n - 1] if n else 0
+            del offsets
+
+        for name, size in sizes.items():
+            path = self.column_path(name)
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+        for name in KEYED_COLUMNS:
+            # Keys of the lost bucket can stay, only a partially written one can't
+            path = self.column_path(f"{name}.keys")
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    keys = f.read()
+                if keys and not keys.endswith(b"\n"):
+                    os.truncate(path, keys.rfind(b"\n") + 1)
+
+    def get_rows(self, start: float, end: float) -> Tuple[memoryview, List[int]]:
+        timestamps = self.map_column("timestamp", "q")
+        if start <= self.start and self.end <= end:
+            return timestamps, list(range(len(timestamps)))
+        return timestamps, [i for i, ts in enumerate(timestamps) if start <= ts < end]
+
+    def query(self, start: float, end: float, result: MetricBucket):
+        """Add all buckets in [start, end) to the result."""
+        timestamps, rows = self.get_rows(start, end)
+        if not rows:
+            return
+
+        n = len(timestamps)
+        traffic = self.map_column("traffic", "q")[:n]
+        sampled = self.map_column("sampled", "q")[:n]
+        status = self.map_column("status", "q")[: n * len(STATUS_CODES)]
+        if len(rows) == n:
+            # Whole segment in range, sum the columns in one go
+            result.traffic += sum(traffic)
+            result.sampled += sum(sampled)
+            for i, code in enumerate(STATUS_CODES):
+                hits = sum(status[i :: len(STATUS_CODES)])
+                if hits:
+                    result.traffic_by_status_code[code] += hits
+        else:
+            for row in rows:
+                result.traffic += traffic[row]
+                result.sampled += sampled[row]
+                for i, code in enumerate(STATUS_CODES):
+                    hits = status[row * len(STATUS_CODES) + i]
+                    if hits:
+                        result.traffic_by_status_code[code] += hits
+
+        for name, attribute in KEYED_COLUMNS.items():
+            keys = self.read_keys(name)
+            offsets = self.map_column(f"{name}.offsets", "q")[:n]
+            pairs = self.map_column(f"{name}.pairs", "I")
+            counts = [0] * len(keys)
+            for first, last in ranges(rows):
+                begin = 2 * offsets[first - 1] if first else 0
+                finish = 2 * offsets[last - 1]
+                for key, count in zip(
+                    pairs[begin:finish:2], pairs[begin + 1 : finish : 2]
+                ):
+                    counts[key] += count
+
+            totals = getattr(result, attribute)
+            for key, count in zip(keys, counts):
+                if count:
+                    totals[key] += count
+
+
+def ranges(rows: List[int]) -> List[Tuple[int, int]]:
+    """Group sorted row numbers into [start, end) ranges of consecutive rows."""
+    result: List[Tuple[int, int]] = []
+    for row in rows:
+        if result and result[-1][1] == row:
+            result[-1] = (result[-1][0], row + 1)
+        else:
+            result.append((row, row + 1))
+    return result
+
+
+class SegmentWriter:
+    def __init__(self, segment: Segment):
+        self.segment = segment
+        segment.repair()
+        self.key_ids: Dict[str, Dict[str, int]] = {}
+        self.offsets: Dict[str, int] = {}
+        self.files = {}
+        for name in KEYED_COLUMNS:
+            self.key_ids[name] = {
+                key: i for i, key in enumerate(segment.read_keys(name))
+            }
+            offsets = segment.map_column(f"{name}.offsets", "q")
+            self.offsets[name] = offsets[-1] if len(offsets) else 0
+
+    def file(self, name: str):
+        if name not in self.files:
+            self.files[name] = open(self.segment.column_path(name), "ab")
+        return self.files[name]
+
+    def append(self, bucket: MetricBucket):
+        for name, attribute in KEYED_COLUMNS.items():
+            key_ids, pairs, new_keys = self.key_ids[name], array("I"), []
+            for key, count in getattr(bucket, attribute).items():
+                if count <= 0:
+                    continue
+                if key not in key_ids:
+                    key_ids[key] = len(key_ids)
+                    new_keys.append(key)
+                pairs.extend((key_ids[key], count))
+
+            if new_keys:
+                self.file(f"{name}.keys").write(
+                    "".join(f"{key}\n" for key in new_keys).encode()
+                )
+            self.file(f"{name}.pairs").write(pairs.tobytes())
+            self.offsets[name] += len(pairs) // 2
+            self.file(f"{name}.offsets").write(array("q", [self.offsets[name]]))
+
+        self.file("status").write(
+            array(
+                "q",
+                [bucket.traffic_by_status_code.get(code, 0) for code in STATUS_CODES],
+            )
+        )
+        self.file("sampled").write(array("q", [bucket.sampled]))
+        self.file("traffic").write(array("q", [bucket.traffic]))
+        self.file("timestamp").write(array("q", [int(bucket.timestamp)]))
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+
+class HistoryStore:
+    """Append-only on-disk history of buckets which left the traffic queue.
+
+    Buckets are stored in columnar segments, one directory per `SEGMENT_SPAN`
+    seconds named after its start epoch. Directory names are our time index, a
+    query only opens and memory-maps segments overlapping the requested range.
+
+    Buckets expire from whichever thread touches the aggregator first, all writes
+    and queries go through a lock.
+
+    Args:
+        path (str): Directory of the store.
+        resolution (float): Size of the buckets we store (seconds).
+
+    """
+
+    SEGMENT_SPAN = 3600
+
+    def __init__(self, path: str, resolution: float = 1):
+        self.path = path
+        self.resolution = resolution
+        self.writer: Optional[SegmentWriter] = None
+        self._lock = RLock()
+        os.makedirs(path, exist_ok=True)
+
+    def get_segment_start(self, timestamp: float) -> int:
+        return int(timestamp - timestamp % self.SEGMENT_SPAN)
+
+    def get_segments(
+        self, start: float = 0, end: float = float("inf")
+    ) -> List[Segment]:
+        segments = []
+        names = [name for name in os.listdir(self.path) if name.isdigit()]
+        for segment_start in sorted(map(int, names)):
+            name = str(segment_start)
+            if segment_start < end and start < segment_start + self.SEGMENT_SPAN:
+                segments.append(Segment(os.path.join(self.path, name)))
+        return segments
+
+    def append(self, bucket: MetricBucket):
+        with self._lock:
+            segment_start = self.get_segment_start(bucket.timestamp)
+            if not self.writer or self.writer.segment.start != segment_start:
+                self.close()
+                path = os.path.join(self.path, str(segment_start))
+                segment = (
+                    Segment(path)
+                    if os.path.exists(os.path.join(path, "meta.json"))
+                    else Segment.create(
+                        path,
+                        segment_start,
+                        segment_start + self.SEGMENT_SPAN,
+                        self.resolution,
+                    )
+                )
+                self.writer = SegmentWriter(segment)
+
+            self.writer.append(bucket)
+
+    def flush(self):
+        with self._lock:
+            if self.writer:
+                for f in self.writer.files.values():
+                    f.flush()
+
+    def close(self):
+        with self._lock:
+            if self.writer:
+                self.writer.close()
+                self.writer = None
+
+    def query(self, start: float, end: float) -> MetricBucket:
+        """Get the sum of all buckets stored within [start, end)."""
+        with self._lock:
+            self.flush()
+            result = MetricBucket(start, sampled=0)
+            for segment in self.get_segments(start, end):
+                segment.query(start, end, result)
+            return result
+
+    def compact(self, older_than: float, resolution: float):
+        """Downsample segments ending before `older_than` to `resolution` buckets.
+
+        The downsampled segment is written next to the original and swapped in with a
+        rename, readers either see the old or the new one.
+
+        """
+        with self._lock:
+            for segment in self.get_segments(end=older_than):
+                if segment.end > older_than or segment.resolution >= resolution:
+                    continue
+                if self.writer and self.writer.segment.start == segment.start:
+                    self.close()
+
+                timestamps = sorted(
+                    {
+                        int(ts - ts % resolution)
+                        for ts in segment.map_column("timestamp", "q")
+                    }
+                )
+
+                tmp_path = segment.path + ".tmp"
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                writer = SegmentWriter(
+                    Segment.create(tmp_path, segment.start, segment.end, resolution)
+                )
+                for ts in timestamps:
+                    bucket = MetricBucket(ts, sampled=0)
+                    segment.query(ts, ts + resolution, bucket)
+                    writer.append(bucket)
+                writer.close()
+
+                old_path = segment.path + ".old"
+                os.rename(segment.path, old_path)
+                os.rename(tmp_path, segment.path)
+                shutil.rmtree(old_path)
+
+
+def benchmark(path: str, days: int = 7):
+    """Fill a store with `days` of 1s buckets and report query times."""
+    store = HistoryStore(path)
+    start = store.get_segment_start(time.time() - days * 86400)
+    endpoints = ["/api", "/", "/users", "/list", "/report"]
+
+    began = time.perf_counter()
+    for i in range(days * 86400):
+        store.append(
+            MetricBucket(
+                start + i,
+                20,
+                {"200s": 15, "500s": 5},
+                {endpoint: 4 for endpoint in endpoints},
+                {f"10.0.{i % 256}.{j}": 1 for j in range(20)},
+            )
+        )
+    store.close()
+    print(f"Wrote {days * 86400} buckets in {time.perf_counter() - began:.2f}s")
+
+    for label, span in [("5 minutes", 300), ("1 hour", 3600), ("1 day", 86400)]:
+        print_query(store, start + 43200, start + 43200 + span, label)
+    print_query(store, start, start + days * 86400, f"{days} days")
+
+
+def print_query(store: HistoryStore, start: float, end: float, label: str = None):
+    began = time.perf_counter()
+    result = store.query(start, end)
+    elapsed = time.perf_counter() - began
+
+    print(
+        "{label}: {traffic} hits, {codes}, top endpoints: {endpoints}"
+        " ({elapsed:.1f}ms)".format(
+            label=label
+            or "{} - {}".format(
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start)),
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(end)),
+            ),
+            traffic=result.traffic,
+            codes=", ".join(
+                f"{code} - {hits}"
+                for code, hits in sorted(result.traffic_by_status_code.items())
+            ),
+            endpoints=", ".join(
+                f"{endpoint} - {hits}"
+                for endpoint, hits in sorted(
+                    result.traffic_by_endpoint.items(), key=lambda item: -item[1]
+                )[:5]
+            ),
+            elapsed=elapsed * 1000,
+        ),
+        flush=True,
+    )
+
+
+def parse_time(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    try:
+        return time.mktime(time.strptime(value, "%Y-%m-%d %H:%M:%S"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "Time should be an epoch or 'YYYY-mm-dd HH:MM:SS'."
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the on-disk bucket history")
+    parser.add_argument("path", help="Directory of the history store")
+    parser.add_argument("--start", type=parse_time, help="Start of the range")
+    parser.add_argument("--end", type=parse_time, help="End of the range")
+    parser.add_argument(
+        "--compact-older-than",
+        type=float,
+        help="Downsample segments older than this many seconds",
+    )
+    parser.add_argument(
+        "--compact-resolution",
+        default=60,
+        type=float,
+        help="Bucket size of downsampled segments (seconds)",
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Fill the store with a week of 1s buckets and time queries over it",
+    )
+    args = parser.parse_args()
+
+    if args.benchmark:
+        return benchmark(args.path)
+
+    store = HistoryStore(args.path)
+    if args.compact_older_than is not None:
+        store.compact(time.time() - args.compact_older_than, args.compact_resolution)
+    if args.start is not None or args.end is not None:
+        print_query(
+            store,
+            args.start if args.start is not None else 0,
+            args.end if args.end is not None else time.time(),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,28 @@
+import os
 from threading import Thread
-from time import sleep
-from typing import List
+from typing import List, Optional, Sequence
 
+from .baselines import ZSCORE, Baseline
+from .block_parser import BlockParser
+from .clock import Clock
 from .display import Display
+from .endpoints import EndpointNormaliser, load_routes
 from .file_observer import FileObserver
-from .log_parser import Parser
+from .history import HistoryStore
+from .log_parser import (
+    AUTO,
+    JSON,
+    LOG_FORMAT,
+    LOG_FORMATS,
+    detect_log_format,
+    make_log_parser,
+)
 from .metrics import MetricsAggregator
+from .prefixes import IPV6_PREFIXES, IpRanges, PrefixTree, load_ranges
+from .sampling import Sampler
+
+# Enough for the first lines of a block to detect its format from
+DETECTION_BYTES = 65536
 
 
 class HTTPMonitor:
@@ -18,6 +35,24 @@ class HTTPMonitor:
         alert_error_rate: float,
         alert_monitoring_window: float,
         ddos_threshold: float,
+        unique_ips_jump: float = 2,
+        sampling_lag_target: Optional[float] = None,
+        history_path: Optional[str] = None,
+        endpoint_depth: int = 1,
+        endpoint_routes: Optional[str] = None,
+        max_endpoints: Optional[int] = 1000,
+        clock: Optional[Clock] = None,
+        baseline_mode: Optional[str] = None,
+        baseline_deviation: float = 3,
+        baseline_half_life: float = 3600,
+        baseline_seasonal_days: float = 0,
+        baseline_path: Optional[str] = None,
+        log_format: str = AUTO,
+        block_mode: bool = False,
+        bandwidth_threshold: Optional[float] = None,
+        prefix_threshold: Optional[float] = None,
+        ipv6_prefixes: Sequence[int] = IPV6_PREFIXES,
+        ip_ranges: Optional[str] = None,
     ):
         # Initial configuration
         self.file = path
@@ -25,22 +60,77 @@ class HTTPMonitor:
         self.reporting_window = reporting_window
         self.bucket_size = bucket_size
         self.alert_monitoring_window = alert_monitoring_window
+        self.clock = clock or Clock()
+        self.log_format = log_format
+        self.block_mode = block_mode
 
         # Child objects
-        self.parser = Parser.make_parser()
+        self.normaliser = EndpointNormaliser(
+            load_routes(endpoint_routes) if endpoint_routes else (),
+            endpoint_depth,
+            max_sections=max_endpoints,
+            window=reporting_window,
+            clock=self.clock,
+        )
+        # Detected from the first lines we read
+        self.parser = (
+            make_log_parser(log_format, self.normaliser) if log_format != AUTO else None
+        )
+        self.block_parser: Optional[BlockParser] = None
         self.display = Display()
+        self.sampler = (
+            Sampler(sampling_lag_target) if sampling_lag_target is not None else None
+        )
+        traffic_baseline = error_rate_baseline = None
+        if baseline_mode:
+            if baseline_path:
+                os.makedirs(baseline_path, exist_ok=True)
+            traffic_baseline, error_rate_baseline = (
+                Baseline(
+                    baseline_half_life,
+                    baseline_seasonal_days,
+                    (
+                        os.path.join(baseline_path, f"{name}.json")
+                        if baseline_path
+                        else None
+                    ),
+                )
+                for name in ("traffic", "error_rate")
+            )
+        prefixes = (
+            PrefixTree(
+                ipv6_prefixes=ipv6_prefixes,
+                ranges=IpRanges(load_ranges(ip_ranges)) if ip_ranges else None,
+            )
+            if prefix_threshold or ip_ranges
+            else None
+        )
         self.metrics = MetricsAggregator(
             reporting_window,
             alert_threshold,
             bucket_size,
             alert_error_rate,
             ddos_threshold,
+            unique_ips_jump,
+            HistoryStore(history_path, bucket_size) if history_path else None,
+            self.clock,
+            traffic_baseline,
+            error_rate_baseline,
+            baseline_mode or ZSCORE,
+            baseline_deviation,
+            bandwidth_threshold,
+            prefix_threshold,
+            prefixes,
         )
 
         # Initialize observers
-        self._metrics_reporting_thread = Thread(target=self.report_metrics)
+        self._metrics_reporting_thread = Thread(
+            target=self.report_metrics, name="metrics-reporting"
+        )
         self.file_observer = FileObserver(path, self)
-        self._alerts_reporting_thread = Thread(target=self.report_alerts)
+        self._alerts_reporting_thread = Thread(
+            target=self.report_alerts, name="alerts-reporting"
+        )
 
     def start(self):
         self._metrics_reporting_thread.start()
@@ -50,22 +140,68 @@ class HTTPMonitor:
     def report_metrics(self):
         try:
             while True:
-                sleep(self.reporting_window)
-                stats = self.metrics.get_stats()
-                self.display.send_stats(stats, self.reporting_window)
+                self.clock.sleep(self.reporting_window)
+                self.report_metrics_once()
         except KeyboardInterrupt:
             pass
 
+    def report_metrics_once(self):
+        stats = self.metrics.get_stats()
+        self.display.send_stats(stats, self.reporting_window)
+
     def report_alerts(self):
         try:
             while True:
-                sleep(self.alert_monitoring_window)
-                for alert in self.metrics.get_alerts():
-                    self.display.send_alert(alert)
+                self.clock.sleep(self.alert_monitoring_window)
+                self.report_alerts_once()
         except KeyboardInterrupt:
             pass
 
+    def report_alerts_once(self):
+        for alert in self.metrics.get_alerts():
+            self.display.send_alert(alert)
+
+    def detect_parser(self, lines: List[str]):
+        """Pick the log format from the first lines, defaulting to ours."""
+        self.log_format = detect_log_format(lines) or LOG_FORMAT
+        self.parser = make_log_parser(self.log_format, self.normaliser)
+
+    def add_block(self, buffer: bytes):
+        """Parse a whole buffer of lines at once, see `BlockParser`."""
+        if self.parser is None:
+            lines = buffer[:DETECTION_BYTES].decode("utf-8", "replace").split("\n")
+            if not any(lines):
+                return
+            self.detect_parser(lines)
+        if self.log_format == JSON:
+            return self.add_lines(str(buffer, "utf-8", "replace").split("\n"))
+
+        if self.block_parser is None:
+            self.block_parser = BlockParser(
+                LOG_FORMATS.get(self.log_format, self.log_format),
+                self.normaliser,
+                self.bucket_size,
+            )
+        try:
+            buckets, skipped = self.block_parser.parse(buffer)
+            self.metrics.add_buckets(buckets)
+        except Exception as e:
+            self.display.warn("Error in log parsing:", e)
+            return
+
+        if skipped:
+            self.display.warn(
+                "Error in log parsing:", f"{skipped} lines couldn't be parsed"
+            )
+
     def add_lines(self, lines: List[str]):
+        if self.parser is None:
+            if not any(lines):
+                return
+            self.detect_parser(lines)
+        if self.sampler:
+            return self.add_sampled_lines(lines)
+
         for line in lines:
             if not line:
                 continue
@@ -75,3 +211,22 @@ class HTTPMonitor:
                 self.metrics.add(data)
             except Exception as e:
                 self.display.warn("Error in log parsing:", e)
+
+    def add_sampled_lines(self, lines: List[str]):
+        """Parse only a sample of lines, adapting the rate to the ingestion lag."""
+        weight, data = self.sampler.stride, None
+        for line in lines:
+            if not line or not self.sampler.should_parse(line):
+                continue
+
+            try:
+                data = self.parser(line)
+                self.metrics.add(data, weight)
+            except Exception as e:
+                self.display.warn("Error in log parsing:", e)
+
+        if data:
+            self.sampler.adjust(
+                self.metrics.get_current_timestamp()
+                - data["time_received_utc_datetimeobj"].timestamp()
+            )
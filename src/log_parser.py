@@ -1,19 +1,356 @@
-import os.path
-from typing import Dict
+import datetime
+import json
+import re
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Pattern, Set, Tuple
 
 import apache_log_parser
 
+from .endpoints import EndpointNormaliser
+
 LOG_FORMAT = """%h - %l %t \"%r\" %>s %b"""
 
+# Named formats, anything else passed as a log format is an Apache format string
+LOG_FORMATS = {
+    "clf": LOG_FORMAT,
+    "common": """%h %l %u %t \"%r\" %>s %b""",
+    "combined": """%h %l %u %t \"%r\" %>s %b \"%{Referer}i\" \"%{User-agent}i\"""",
+}
+JSON = "json"
+AUTO = "auto"
+# Most specific formats first, a combined line also matches the common format
+DETECTION_ORDER = [JSON, "combined", "common", "clf"]
+DETECTION_LINES = 20
+
+MONTHS = {
+    month: i + 1
+    for i, month in enumerate(
+        ["Jan", "Feb", "Mar", "Apr", "May", "Jun"]
+        + ["Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+    )
+}
+
+LineParser = Callable[[str], Dict[str, object]]
+
 
 class Parser(apache_log_parser.Parser):
+    def __init__(self, format_string: str, normaliser: EndpointNormaliser = None):
+        super().__init__(format_string)
+        self.normalise = (normaliser or EndpointNormaliser()).normalise
+
     def parse(self, line: str) -> Dict[str, str]:
         results = super().parse(line)
-        results["request_url_subpath"] = (
-            "/" + results["request_url_path"][1:].split("/")[0]
-        )
+        results["request_url_subpath"] = self.normalise(results["request_url_path"])
         return results
 
     @staticmethod
-    def make_parser(log_format: str = LOG_FORMAT):
-        return Parser(log_format).parse
+    def make_parser(
+        log_format: str = LOG_FORMAT, normaliser: EndpointNormaliser = None
+    ):
+        return Parser(log_format, normaliser).parse
+
+
+@lru_cache(maxsize=4096)
+def parse_apache_time(value: str) -> datetime.datetime:
+    """Parse '[09/May/2018:16:00:41 +0000]' into an UTC datetime.
+
+    Lines logged within the same second share the timestamp, so a cache saves us
+    most of the parsing.
+
+    Raises:
+        ValueError: If the value isn't a time in this format, ie. has an unknown
+            month or misses the zone.
+
+    """
+    value = value.strip("[]")
+    if len(value) != 26 or value[21] not in "+-" or value[3:6] not in MONTHS:
+        raise ValueError(f"Invalid time: {value!r}")
+
+    offset = int(value[22:24]) * 3600 + int(value[24:26]) * 60
+    tz = datetime.timezone(
+        datetime.timedelta(seconds=-offset if value[21] == "-" else offset)
+    )
+    return datetime.datetime(
+        int(value[7:11]),
+        MONTHS[value[3:6]],
+        int(value[0:2]),
+        int(value[12:14]),
+        int(value[15:17]),
+        int(value[18:20]),
+        tzinfo=tz,
+    ).astimezone(datetime.timezone.utc)
+
+
+@lru_cache(maxsize=4096)
+def parse_iso_time(value: str) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value).astimezone(datetime.timezone.utc)
+
+
+def make_record(
+    normalise: Callable[[str], str],
+    remote_host: str,
+    remote_logname: str,
+    request: str,
+    status: str,
+    response_bytes: str,
+    time_received: str,
+    time_received_utc: datetime.datetime,
+) -> Dict[str, object]:
+    """Make the minimal record `MetricsAggregator` needs, whatever the log format."""
+    method, _, rest = request.partition(" ")
+    path = rest.partition(" ")[0].partition("?")[0]
+    return {
+        "remote_host": remote_host,
+        "remote_logname": remote_logname,
+        "request_method": method,
+        "request_url_path": path,
+        "request_url_subpath": normalise(path),
+        "status": status,
+        "response_bytes_clf": response_bytes,
+        "time_received": time_received,
+        "time_received_utc_datetimeobj": time_received_utc,
+    }
+
+
+class ApacheFormatParser:
+    """Fast extractor of Apache format strings.
+
+    Compiles the format into a single regex capturing only the fields we aggregate,
+    other directives (ie. user agents, referers) are skipped without being parsed.
+
+    Raises:
+        ValueError: If the format misses any of the fields we need.
+
+    """
+
+    DIRECTIVE = re.compile(r"%(?:\{[^}]*\})?[<>]?[a-zA-Z%]")
+    # Fields never span lines, so the same patterns can scan whole buffers
+    FIELDS = {
+        "h": ("remote_host", r"\S+"),
+        "a": ("remote_host", r"\S+"),
+        "l": ("remote_logname", r"\S+"),
+        "u": ("remote_user", r"\S+"),
+        "t": ("time_received", r"\[[^\]\n]+\]"),
+        "r": ("request", r"[^\"\n]*"),
+        "s": ("status", r"\d{3}"),
+        "b": ("response_bytes", r"\d+|-"),
+        "B": ("response_bytes", r"\d+|-"),
+    }
+    REQUIRED = {"remote_host", "time_received", "request", "status"}
+
+    def __init__(self, format_string: str, normaliser: EndpointNormaliser = None):
+        self.normalise = (normaliser or EndpointNormaliser()).normalise
+
+        pattern, names = self.compile_format(format_string, self.FIELDS)
+        self.regex = re.compile(pattern)
+        # The human user, %l is only filled in by identd
+        self.user_group = "remote_user" if "remote_user" in names else "remote_logname"
+        self.has_user = self.user_group in names
+        self.has_bytes = "response_bytes" in names
+
+    @classmethod
+    def compile_format(
+        cls, format_string: str, fields: Dict[str, Tuple[str, str]]
+    ) -> Tuple[str, Set[str]]:
+        """Compile a format string into a regex with a named group per field.
+
+        Args:
+            fields (dict): Directive => field name and pattern, a pattern holding the
+                named group itself is used as is.
+
+        Returns:
+            tuple: Regex pattern and the names of its groups.
+
+        """
+        pattern, names, position = "", set(), 0
+        for match in cls.DIRECTIVE.finditer(format_string):
+            pattern += re.escape(format_string[position : match.start()])
+            position = match.end()
+
+            directive = match.group()
+            name, field_pattern = fields.get(directive[-1], (None, None))
+            if directive == "%%":
+                pattern += "%"
+            elif name and name not in names and "{" not in directive:
+                names.add(name)
+                group = f"(?P<{name}>"
+                pattern += (
+                    field_pattern
+                    if group in field_pattern
+                    else f"{group}{field_pattern})"
+                )
+            else:
+                quoted = format_string[match.start() - 1 : match.start()] == '"'
+                pattern += r"[^\"\n]*" if quoted else r"\S*"
+        pattern += re.escape(format_string[position:])
+
+        missing = cls.REQUIRED - names
+        if missing:
+            raise ValueError("Log format misses {}.".format(", ".join(sorted(missing))))
+        return pattern, names
+
+    def parse(self, line: str) -> Dict[str, object]:
+        match = self.regex.match(line)
+        if match is None:
+            raise ValueError(f"Line doesn't match the log format: {line!r}")
+
+        time_received = match["time_received"]
+        return make_record(
+            self.normalise,
+            match["remote_host"],
+            match[self.user_group] if self.has_user else "-",
+            match["request"],
+            match["status"],
+            match["response_bytes"] if self.has_bytes else "-",
+            time_received,
+            parse_apache_time(time_received),
+        )
+
+
+class JsonLinesParser:
+    """Fast extractor of JSON lines, ie. nginx `escape=json` log formats.
+
+    Rather than decoding whole objects, we only pull and decode the few values we
+    need. A file's lines share their layout, so the order of keys is learnt from the
+    first line and compiled into a single regex, lines with another layout fall back
+    to looking keys up one by one. Keys are assumed to be on the top level of objects.
+
+    Args:
+        keys (dict): Record field => candidate JSON keys, in order of preference.
+
+    """
+
+    KEYS = {
+        "remote_host": ["remote_addr", "client_ip", "remote_host"],
+        "remote_logname": ["remote_user", "user"],
+        "request": ["request"],
+        "request_method": ["request_method", "method"],
+        "request_uri": ["request_uri", "uri", "path"],
+        "status": ["status"],
+        "response_bytes": ["body_bytes_sent", "bytes_sent", "response_bytes"],
+        "time_local": ["time_local"],
+        "time_iso8601": ["time_iso8601", "timestamp", "time"],
+    }
+    # Unrolled string pattern, an alternation per character is several times slower
+    VALUE = r'\s*:\s*("[^"\\]*(?:\\.[^"\\]*)*"|-?[\d.]+|null)'
+
+    def __init__(
+        self,
+        normaliser: EndpointNormaliser = None,
+        keys: Optional[Dict[str, List[str]]] = None,
+    ):
+        self.normalise = (normaliser or EndpointNormaliser()).normalise
+        self.needles = {
+            field: [f'"{key}"' for key in candidates]
+            for field, candidates in (keys or self.KEYS).items()
+        }
+        self.value = re.compile(self.VALUE)
+        self.layout: Optional[Pattern] = None
+        self.layout_groups: List[int] = []
+
+    @staticmethod
+    def decode(value: str) -> Optional[str]:
+        if value[0] == '"':
+            return json.loads(value) if "\\" in value else value[1:-1]
+        return None if value == "null" else value
+
+    def learn_layout(self, line: str):
+        found = []
+        for field, needles in self.needles.items():
+            for needle in needles:
+                position = line.find(needle)
+                if position >= 0:
+                    found.append((position, field, needle))
+                    break
+        found.sort()
+        if not any(field == "status" for _, field, _ in found):
+            # Not a log line, try again with the next one
+            return
+
+        self.layout = re.compile(
+            r"[^\n]*?".join(re.escape(needle) + self.VALUE for _, _, needle in found)
+        )
+        # Group of every field, 0 being an always empty one for missing fields
+        groups = {field: i + 1 for i, (_, field, _) in enumerate(found)}
+        self.layout_groups = [groups.get(field, 0) for field in self.needles]
+
+    def get(self, line: str, field: str) -> Optional[str]:
+        for needle in self.needles[field]:
+            position = line.find(needle)
+            match = position >= 0 and self.value.match(line, position + len(needle))
+            if match:
+                return self.decode(match.group(1))
+        return None
+
+    def extract(self, line: str) -> Dict[str, Optional[str]]:
+        if self.layout is None:
+            self.learn_layout(line)
+
+        match = self.layout and self.layout.search(line)
+        if not match:
+            return {field: self.get(line, field) for field in self.needles}
+
+        groups = (None, *match.groups())
+        return {
+            field: groups[i] and self.decode(groups[i])
+            for field, i in zip(self.needles, self.layout_groups)
+        }
+
+    def parse(self, line: str) -> Dict[str, object]:
+        if not line.lstrip().startswith("{"):
+            raise ValueError(f"Line isn't a JSON object: {line!r}")
+
+        values = self.extract(line)
+        request = values["request"] or "{} {}".format(
+            values["request_method"] or "-", values["request_uri"] or "/"
+        )
+        time_local = values["time_local"]
+        time_received = time_local or values["time_iso8601"]
+        if not time_received or not values["status"]:
+            raise ValueError(f"Line misses time or status: {line!r}")
+
+        return make_record(
+            self.normalise,
+            values["remote_host"] or "-",
+            values["remote_logname"] or "-",
+            request,
+            values["status"],
+            values["response_bytes"] or "-",
+            time_received,
+            (
+                parse_apache_time(time_local)
+                if time_local
+                else parse_iso_time(time_received)
+            ),
+        )
+
+
+def make_log_parser(
+    log_format: str = LOG_FORMAT, normaliser: EndpointNormaliser = None
+) -> LineParser:
+    """Get the fast extractor of a named log format or an Apache format string."""
+    if log_format == JSON:
+        return JsonLinesParser(normaliser).parse
+    return ApacheFormatParser(LOG_FORMATS.get(log_format, log_format), normaliser).parse
+
+
+def detect_log_format(lines: List[str]) -> Optional[str]:
+    """Pick the format parsing most of the first lines of a file.
+
+    Returns:
+        str: Name of the format, None if none of them parses any line.
+
+    """
+    lines = [line for line in lines if line.strip()][:DETECTION_LINES]
+    best, best_count = None, 0
+    for name in DETECTION_ORDER:
+        parse, count = make_log_parser(name), 0
+        for line in lines:
+            try:
+                parse(line)
+                count += 1
+            except ValueError:
+                pass
+        if count > best_count:
+            best, best_count = name, count
+    return best
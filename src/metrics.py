@@ -1,10 +1,30 @@
 import time
 from collections import Counter, defaultdict, deque
-from typing import Deque, Dict, List, Type, Union
-
-from .alerts import DdosAlert, ErrorRateAlert, TrafficAlert
-
-StatsDictValues = Union[int, Dict[str, int]]
+from threading import Lock
+from typing import TYPE_CHECKING, Deque, Dict, List, Optional, Tuple, Type, Union
+
+from .alerts import (
+    BandwidthAlert,
+    BaselineAlert,
+    DdosAlert,
+    ErrorRateAlert,
+    ErrorRateBaselineAlert,
+    PrefixFloodAlert,
+    TrafficAlert,
+    TrafficBaselineAlert,
+    UniqueIpsAlert,
+)
+from .baselines import ZSCORE, Baseline
+from .cardinality import Cardinality
+from .clock import Clock
+from .histogram import LogLinearHistogram
+from .prefixes import PrefixTree
+from .sampling import get_relative_error
+
+if TYPE_CHECKING:
+    from .history import HistoryStore
+
+StatsDictValues = Union[int, float, Dict[str, int]]
 
 
 def get_status_code_bucket(status: str) -> str:
@@ -19,7 +39,15 @@ def get_status_code_bucket(status: str) -> str:
     return "{}00s".format(status[0])
 
 
+def get_response_size(data: Dict[str, str]) -> int:
+    """Get the size of a response, '-' meaning no body was sent."""
+    size = data["response_bytes_clf"]
+    return 0 if size == "-" else int(size)
+
+
 class MetricBucket:
+    MAX_RESPONSE_SIZE_ENDPOINTS = 4
+
     def __init__(
         self,
         timestamp: float = 0,
@@ -27,9 +55,17 @@ class MetricBucket:
         traffic_by_status_code: Dict[str, int] = None,
         traffic_by_endpoint: Dict[str, int] = None,
         traffic_by_ip: Dict[str, int] = None,
+        sampled: int = None,
+        cardinality: Cardinality = None,
+        response_bytes: int = 0,
+        response_bytes_by_endpoint: Dict[str, int] = None,
+        response_sizes: LogLinearHistogram = None,
+        response_sizes_by_endpoint: Dict[str, LogLinearHistogram] = None,
     ):
         self.timestamp = timestamp
         self.traffic = traffic
+        # Number of lines actually parsed, lower than traffic when load-shedding
+        self.sampled = traffic if sampled is None else sampled
         self.traffic_by_status_code = (
             defaultdict(int) if not traffic_by_status_code else traffic_by_status_code
         )
@@ -37,6 +73,19 @@ class MetricBucket:
             defaultdict(int) if not traffic_by_endpoint else traffic_by_endpoint
         )
         self.traffic_by_ip = defaultdict(int) if not traffic_by_ip else traffic_by_ip
+        # Sketches only live in the buckets of the queue, they can be merged but,
+        # unlike counters, can't be subtracted from a running total.
+        self.cardinality = cardinality
+        self.response_bytes = response_bytes
+        self.response_bytes_by_endpoint = (
+            defaultdict(int)
+            if not response_bytes_by_endpoint
+            else response_bytes_by_endpoint
+        )
+        self.response_sizes = response_sizes or LogLinearHistogram()
+        # Like sketches, only kept in the buckets of the queue, for the first
+        # `MAX_RESPONSE_SIZE_ENDPOINTS` endpoints of a bucket
+        self.response_sizes_by_endpoint = response_sizes_by_endpoint
 
     def __add__(self, other):
         return MetricBucket(
@@ -50,6 +99,18 @@ class MetricBucket:
                 Counter(self.traffic_by_endpoint) + Counter(other.traffic_by_endpoint)
             ),
             dict(Counter(self.traffic_by_ip) + Counter(other.traffic_by_ip)),
+            self.sampled + other.sampled,
+            (
+                self.cardinality.merge(other.cardinality)
+                if self.cardinality and other.cardinality
+                else None
+            ),
+            self.response_bytes + other.response_bytes,
+            dict(
+                Counter(self.response_bytes_by_endpoint)
+                + Counter(other.response_bytes_by_endpoint)
+            ),
+            self.response_sizes + other.response_sizes,
         )
 
     def __radd__(self, other):
@@ -71,25 +132,101 @@ class MetricBucket:
             defaultdict(
                 int, Counter(self.traffic_by_ip) - Counter(other.traffic_by_ip)
             ),
+            self.sampled - other.sampled,
+            None,
+            self.response_bytes - other.response_bytes,
+            defaultdict(
+                int,
+                Counter(self.response_bytes_by_endpoint)
+                - Counter(other.response_bytes_by_endpoint),
+            ),
+            self.response_sizes - other.response_sizes,
         )
 
     def __rsub__(self, other):
         return self.__rsub__(other)
 
+    @property
+    def sample_rate(self) -> float:
+        return self.sampled / self.traffic if self.traffic else 1.0
+
     def as_dict(self) -> Dict[str, StatsDictValues]:
         return {
             "traffic": self.traffic,
             "traffic_by_status_code": self.traffic_by_status_code,
             "traffic_by_endpoint": self.traffic_by_endpoint,
             "traffic_by_ip": self.traffic_by_ip,
+            "sample_rate": self.sample_rate,
+            "sample_error": get_relative_error(self.traffic, self.sampled),
+            "response_bytes": self.response_bytes,
+            "response_bytes_by_endpoint": self.response_bytes_by_endpoint,
+            "response_size": self.response_sizes.as_dict(),
         }
 
-    def add_user(self, data: Dict[str, str]):
-        self.traffic += 1
+    def add_user(self, data: Dict[str, str], weight: int = 1):
+        """Add a single log line to the bucket.
+
+        Args:
+            data (dict): Parsed log line.
+            weight (int): Number of lines this one stands for, when sampling 1 in n
+                lines every parsed line counts n times.
+
+        """
+        self.traffic += weight
+        self.sampled += 1
         status_code = get_status_code_bucket(data["status"])
-        self.traffic_by_status_code[status_code] += 1
-        self.traffic_by_endpoint[data["request_url_subpath"]] += 1
-        self.traffic_by_ip[data["remote_host"]] += 1
+        self.traffic_by_status_code[status_code] += weight
+        self.traffic_by_endpoint[data["request_url_subpath"]] += weight
+        self.traffic_by_ip[data["remote_host"]] += weight
+        if self.cardinality:
+            self.cardinality.add(data)
+        self.add_response_size(
+            data["request_url_subpath"], get_response_size(data), weight
+        )
+
+    def add_response_size(self, endpoint: str, size: int, weight: int = 1):
+        self.response_bytes += size * weight
+        self.response_bytes_by_endpoint[endpoint] += size * weight
+        self.response_sizes.add(size, weight)
+        if self.response_sizes_by_endpoint is None:
+            return
+
+        histogram = self.response_sizes_by_endpoint.get(endpoint)
+        if histogram is None:
+            if len(self.response_sizes_by_endpoint) >= self.MAX_RESPONSE_SIZE_ENDPOINTS:
+                return
+            histogram = self.response_sizes_by_endpoint[endpoint] = LogLinearHistogram()
+        histogram.add(size, weight)
+
+    def merge(self, other: "MetricBucket"):
+        """Add another bucket's counts in place, ie. aggregates of a whole block."""
+        self.traffic += other.traffic
+        self.sampled += other.sampled
+        for counts, other_counts in (
+            (self.traffic_by_status_code, other.traffic_by_status_code),
+            (self.traffic_by_endpoint, other.traffic_by_endpoint),
+            (self.traffic_by_ip, other.traffic_by_ip),
+            (self.response_bytes_by_endpoint, other.response_bytes_by_endpoint),
+        ):
+            for key, count in other_counts.items():
+                counts[key] = counts.get(key, 0) + count
+        if self.cardinality and other.cardinality:
+            self.cardinality = self.cardinality.merge(other.cardinality)
+
+        self.response_bytes += other.response_bytes
+        self.response_sizes.merge(other.response_sizes)
+        if (
+            self.response_sizes_by_endpoint is not None
+            and other.response_sizes_by_endpoint
+        ):
+            for endpoint, histogram in other.response_sizes_by_endpoint.items():
+                if endpoint in self.response_sizes_by_endpoint:
+                    self.response_sizes_by_endpoint[endpoint].merge(histogram)
+                elif (
+                    len(self.response_sizes_by_endpoint)
+                    < self.MAX_RESPONSE_SIZE_ENDPOINTS
+                ):
+                    self.response_sizes_by_endpoint[endpoint] = histogram
 
 
 def remove_outdated_data(func):
@@ -108,26 +245,118 @@ class MetricsAggregator:
         bucket_size: float,
         alert_error_rate: float,
         ddos_threshold: float,
+        unique_ips_jump: float = 2,
+        history: "HistoryStore" = None,
+        clock: Clock = None,
+        traffic_baseline: Baseline = None,
+        error_rate_baseline: Baseline = None,
+        baseline_mode: str = ZSCORE,
+        baseline_deviation: float = 3,
+        bandwidth_threshold: Optional[float] = None,
+        prefix_threshold: Optional[float] = None,
+        prefixes: Optional[PrefixTree] = None,
     ):
         # Initial configuration
         self.alert_threshold = alert_threshold
         self.reporting_window = reporting_window
         self.bucket_size = bucket_size
+        self.history = history
+        self.clock = clock or Clock()
+        self.prefixes = prefixes or (PrefixTree() if prefix_threshold else None)
 
         # Session-specific variables
         self.traffic_queue: Deque[Type[MetricBucket]] = deque()
         self.stats = MetricBucket()
+        # Watcher and reporting threads all expire buckets, each one only once, and
+        # share the prefix tree
+        self._expiry_lock = Lock()
 
         # Register all active alerts
         self.alerts = [
-            TrafficAlert(reporting_window, alert_threshold),
-            ErrorRateAlert(reporting_window, alert_error_rate),
+            TrafficBaselineAlert(
+                reporting_window,
+                alert_threshold,
+                traffic_baseline,
+                baseline_mode,
+                baseline_deviation,
+                self,
+            )
+            if traffic_baseline
+            else TrafficAlert(reporting_window, alert_threshold),
+            *(
+                [BandwidthAlert(reporting_window, bandwidth_threshold)]
+                if bandwidth_threshold
+                else []
+            ),
+            ErrorRateBaselineAlert(
+                reporting_window,
+                alert_error_rate,
+                error_rate_baseline,
+                baseline_mode,
+                baseline_deviation,
+                self,
+            )
+            if error_rate_baseline
+            else ErrorRateAlert(reporting_window, alert_error_rate),
             DdosAlert(reporting_window, ddos_threshold),
+            *(
+                [PrefixFloodAlert(reporting_window, prefix_threshold, self.prefixes)]
+                if prefix_threshold and self.prefixes
+                else []
+            ),
+            UniqueIpsAlert(reporting_window, unique_ips_jump, self),
+        ]
+        self.baseline_alerts = [
+            alert for alert in self.alerts if isinstance(alert, BaselineAlert)
         ]
 
     @remove_outdated_data
     def get_stats(self) -> Dict[str, StatsDictValues]:
-        return self.stats.as_dict()
+        stats: Dict[str, StatsDictValues] = {
+            **self.stats.as_dict(),
+            **self.get_cardinality().as_dict(),
+            "response_size_by_endpoint": {
+                endpoint: histogram.as_dict()
+                for endpoint, histogram in self.get_response_sizes_by_endpoint().items()
+            },
+        }
+        if self.prefixes:
+            with self._expiry_lock:
+                stats["traffic_by_prefix"] = self.prefixes.get_top()
+        return stats
+
+    @remove_outdated_data
+    def get_window(self) -> Tuple[MetricBucket, Cardinality]:
+        """Get the running total and merged sketches of the reporting window."""
+        return self.stats, self.get_cardinality()
+
+    def get_cardinality(
+        self, start: Optional[float] = None, end: Optional[float] = None
+    ) -> Cardinality:
+        """Get unique visitors/users sketches by merging buckets of the queue.
+
+        Args:
+            start (float): Only merge buckets starting at or after this epoch.
+            end (float): Only merge buckets starting before this epoch.
+
+        """
+        return Cardinality.merge_all(
+            bucket.cardinality
+            for bucket in list(self.traffic_queue)
+            if (start is None or bucket.timestamp >= start)
+            and (end is None or bucket.timestamp < end)
+        )
+
+    def get_response_sizes_by_endpoint(self) -> Dict[str, LogLinearHistogram]:
+        """Get response size histograms of endpoints by merging buckets of the queue."""
+        result: Dict[str, LogLinearHistogram] = {}
+        for bucket in list(self.traffic_queue):
+            histograms = bucket.response_sizes_by_endpoint or {}
+            for endpoint, histogram in histograms.items():
+                result[endpoint] = (
+                    result[endpoint] + histogram if endpoint in result else histogram
+                )
+        return result
 
     def get_aggregated_timestamp(self, timestamp: float) -> int:
         """Get bucket for a timestamp.
@@ -148,37 +377,82 @@ class MetricsAggregator:
         return int(timestamp - timestamp % self.bucket_size)
 
     @remove_outdated_data
-    def add(self, data):
+    def add(self, data, weight: int = 1):
         timestamp = self.get_aggregated_timestamp(
             data["time_received_utc_datetimeobj"].timestamp()
         )
         if not self.traffic_queue or self.traffic_queue[-1].timestamp != timestamp:
-            # If time is 5, and our bucket_size is
-            self.traffic_queue.append(MetricBucket(timestamp * self.bucket_size))
+            self.traffic_queue.append(
+                MetricBucket(
+                    timestamp,
+                    cardinality=Cardinality(),
+                    response_sizes_by_endpoint={},
+                )
+            )
 
         # Double addition as self.stats is a sum of all objects inside self.traffic.queue
         # It'll be faster this way than substracting old, and then adding new object to self.stats
-        self.traffic_queue[-1].add_user(data)
-        self.stats.add_user(data)
+        self.traffic_queue[-1].add_user(data, weight)
+        self.stats.add_user(data, weight)
+        if self.prefixes:
+            with self._expiry_lock:
+                self.prefixes.add(data["remote_host"], weight)
+
+    @remove_outdated_data
+    def add_buckets(self, buckets: List[MetricBucket]):
+        """Add pre-aggregated buckets, ie. from `BlockParser`, oldest first."""
+        for bucket in buckets:
+            if bucket.cardinality is None:
+                bucket.cardinality = Cardinality()
+            if bucket.response_sizes_by_endpoint is None:
+                bucket.response_sizes_by_endpoint = {}
+            if self.prefixes:
+                with self._expiry_lock:
+                    self.prefixes.update(bucket.traffic_by_ip)
+            tail = self.traffic_queue[-1] if self.traffic_queue else None
+            if tail and tail.timestamp == bucket.timestamp:
+                tail.merge(bucket)
+            else:
+                self.traffic_queue.append(bucket)
+            self.stats.merge(bucket)
 
     @remove_outdated_data
     def get_alerts(self) -> List[Dict[str, str]]:
         alerts = []
-        for alert in self.alerts:
-            alert_status_changed = alert.get_alert_status(self.stats)
+        # PrefixFloodAlert walks the prefix tree
+        with self._expiry_lock:
+            changes = [alert.get_alert_status(self.stats) for alert in self.alerts]
+        for alert_status_changed in changes:
             if alert_status_changed:
+                # Stamp alerts with our clock, it isn't the wall clock in simulations
+                alert_status_changed["time"] = time.strftime(
+                    "%H:%M:%S", time.localtime(self.get_current_timestamp())
+                )
                 alerts.append(alert_status_changed)
 
         return alerts
 
     def get_current_timestamp(self) -> float:
-        return time.time()
+        return self.clock.time()
 
     def _remove_outdated_data(self):
-        while (
-            self.traffic_queue
-            and (self.get_current_timestamp() - self.traffic_queue[0].timestamp)
-            > self.reporting_window
-        ):
-            outdated_data = self.traffic_queue.popleft()
-            self.stats -= outdated_data
+        with self._expiry_lock:
+            appended = False
+            while (
+                self.traffic_queue
+                and (self.get_current_timestamp() - self.traffic_queue[0].timestamp)
+                > self.reporting_window
+            ):
+                outdated_data = self.traffic_queue.popleft()
+                self.stats -= outdated_data
+                for alert in self.baseline_alerts:
+                    alert.add_bucket(outdated_data, self.bucket_size)
+                if self.prefixes:
+                    self.prefixes.subtract(outdated_data.traffic_by_ip)
+                if self.history:
+                    self.history.append(outdated_data)
+                    appended = True
+
+            if appended:
+                # Buckets leave the queue about once a `bucket_size`, no need to buffer
+                self.history.flush()
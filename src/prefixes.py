@@ -0,0 +1,238 @@
+import heapq
+import ipaddress
+import itertools
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+IPV4_PREFIXES = (16, 24)
+IPV6_PREFIXES = (32, 48, 64)
+BITS = {4: 32, 6: 128}
+NETWORKS = {4: ipaddress.IPv4Network, 6: ipaddress.IPv6Network}
+
+# Version, integer value of the prefix of every level, and name of the range
+PrefixPath = Tuple[int, Tuple[int, ...], Optional[str]]
+
+
+class IpRanges:
+    """Named CIDR ranges, ie. a cloud provider's published ranges.
+
+    Ranges are kept in a hash table per prefix length, an address is matched by
+    masking it to every length we have ranges of, longest first, and the most
+    specific range wins. Lookups cost at most one probe per distinct length, no
+    matter how many ranges are loaded, and published lists only use a couple dozen
+    lengths.
+
+    """
+
+    def __init__(self, ranges: Iterable[Tuple[str, Optional[str]]] = ()):
+        self.tables: Dict[int, Dict[int, Dict[int, str]]] = {4: {}, 6: {}}
+        self.lengths: Dict[int, List[int]] = {4: [], 6: []}
+        for cidr, name in ranges:
+            self.add(cidr, name)
+
+    def __len__(self) -> int:
+        return sum(
+            len(table) for tables in self.tables.values() for table in tables.values()
+        )
+
+    def add(self, cidr: str, name: Optional[str] = None):
+        network = ipaddress.ip_network(cidr, strict=False)
+        tables = self.tables[network.version]
+        if network.prefixlen not in tables:
+            tables[network.prefixlen] = {}
+            self.lengths[network.version] = sorted(tables, reverse=True)
+
+        key = int(network.network_address) >> (
+            BITS[network.version] - network.prefixlen
+        )
+        tables[network.prefixlen][key] = name or str(network)
+
+    def match(self, version: int, value: int) -> Optional[str]:
+        """Get the name of the most specific range an address falls into."""
+        tables, bits = self.tables[version], BITS[version]
+        for length in self.lengths[version]:
+            name = tables[length].get(value >> (bits - length))
+            if name is not None:
+                return name
+        return None
+
+
+def load_ranges(path: str) -> List[Tuple[str, Optional[str]]]:
+    """Load named ranges from a file, one `<cidr> [name]` per line.
+
+    `#` starts a comment, ranges without a name are named after themselves.
+
+    """
+    with open(path) as f:
+        lines = (line.split("#", 1)[0].split(None, 1) for line in f)
+        return [
+            (fields[0], fields[1].strip() if len(fields) > 1 else None)
+            for fields in lines
+            if fields
+        ]
+
+
+class PrefixNode:
+    __slots__ = ("count", "children")
+
+    def __init__(self):
+        self.count = 0
+        self.children: Dict[int, PrefixNode] = {}
+
+
+class PrefixTree:
+    """Requests per address prefix over the reporting window.
+
+    A radix tree per IP version, whose levels are the prefix lengths we aggregate
+    by, ie. /16 then /24 for IPv4, every node counting the requests of its whole
+    subtree. Counts of a bucket are added as lines come in, and subtracted once the
+    bucket leaves the window, nodes dropping to 0 are pruned, so the tree only holds
+    prefixes seen within the window.
+
+    A node never counts more than its parent: heavy prefixes are found by only
+    descending into nodes above the threshold, and the top ones by expanding the
+    heaviest nodes first, we never visit the rest of the tree.
+
+    Addresses repeat over and over again, their path in the tree and range are kept
+    in a LRU cache.
+
+    Args:
+        ipv4_prefixes (list): IPv4 prefix lengths to aggregate by, shortest first.
+        ipv6_prefixes (list): IPv6 prefix lengths to aggregate by, shortest first.
+        ranges (IpRanges): Named ranges to count requests of as well.
+        cache_size (int): Number of addresses we keep the path of.
+
+    """
+
+    def __init__(
+        self,
+        ipv4_prefixes: Sequence[int] = IPV4_PREFIXES,
+        ipv6_prefixes: Sequence[int] = IPV6_PREFIXES,
+        ranges: Optional[IpRanges] = None,
+        cache_size: int = 65536,
+    ):
+        self.levels = {4: sorted(ipv4_prefixes), 6: sorted(ipv6_prefixes)}
+        self.ranges = ranges
+        self.roots = {4: PrefixNode(), 6: PrefixNode()}
+        self.traffic_by_range: Dict[str, int] = {}
+
+        self.get_path = lru_cache(maxsize=cache_size)(self._get_path)
+
+    def _get_path(self, ip: str) -> Optional[PrefixPath]:
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            # Hostnames, or '-' when the address isn't logged
+            return None
+
+        version, value = address.version, int(address)
+        keys = tuple(
+            value >> (BITS[version] - length) for length in self.levels[version]
+        )
+        name = self.ranges.match(version, value) if self.ranges else None
+        return version, keys, name
+
+    def add(self, ip: str, count: int = 1):
+        """Count requests of an address, negative counts subtract them."""
+        path = self.get_path(ip)
+        if path is None:
+            return
+
+        version, keys, name = path
+        node = self.roots[version]
+        node.count += count
+        for key in keys:
+            child = node.children.get(key)
+            if child is None:
+                child = node.children[key] = PrefixNode()
+            child.count += count
+            if child.count <= 0:
+                # Its whole subtree is down to 0 as well
+                del node.children[key]
+                break
+            node = child
+
+        if name is not None:
+            total = self.traffic_by_range.get(name, 0) + count
+            if total > 0:
+                self.traffic_by_range[name] = total
+            else:
+                self.traffic_by_range.pop(name, None)
+
+    def update(self, traffic_by_ip: Dict[str, int]):
+        for ip, hits in traffic_by_ip.items():
+            self.add(ip, hits)
+
+    def subtract(self, traffic_by_ip: Dict[str, int]):
+        for ip, hits in traffic_by_ip.items():
+            self.add(ip, -hits)
+
+    def clear(self):
+        self.roots = {4: PrefixNode(), 6: PrefixNode()}
+        self.traffic_by_range = {}
+
+    def get_prefix(self, version: int, depth: int, key: int) -> str:
+        length = self.levels[version][depth]
+        return str(NETWORKS[version]((key << (BITS[version] - length), length)))
+
+    def get_heavy(self, threshold: float) -> Dict[str, int]:
+        """Get the most specific prefixes, and ranges, with at least `threshold` hits.
+
+        A prefix is only reported when none of its sub-prefixes are heavy, a single
+        flooding /24 shows up as such rather than as its /16.
+
+        """
+        heavy: Dict[str, int] = {}
+        for version, root in self.roots.items():
+            stack = [(0, key, node) for key, node in root.children.items()]
+            while stack:
+                depth, key, node = stack.pop()
+                if node.count < threshold:
+                    continue
+
+                children = [
+                    (depth + 1, child_key, child)
+                    for child_key, child in node.children.items()
+                    if child.count >= threshold
+                ]
+                if children:
+                    stack.extend(children)
+                else:
+                    heavy[self.get_prefix(version, depth, key)] = node.count
+
+        heavy.update(
+            (name, hits)
+            for name, hits in self.traffic_by_range.items()
+            if hits >= threshold
+        )
+        return heavy
+
+    def get_top(self, n: int = 10) -> Dict[str, int]:
+        """Get the `n` busiest prefixes of any length, and ranges."""
+        tiebreak = itertools.count()
+        heap = [
+            (-node.count, next(tiebreak), version, 0, key, node)
+            for version, root in self.roots.items()
+            for key, node in root.children.items()
+        ]
+        heapq.heapify(heap)
+
+        top: List[Tuple[str, int]] = []
+        while heap and len(top) < n:
+            hits, _, version, depth, key, node = heapq.heappop(heap)
+            top.append((self.get_prefix(version, depth, key), -hits))
+            for child_key, child in node.children.items():
+                heapq.heappush(
+                    heap,
+                    (
+                        -child.count,
+                        next(tiebreak),
+                        version,
+                        depth + 1,
+                        child_key,
+                        child,
+                    ),
+                )
+
+        top.extend(self.traffic_by_range.items())
+        return dict(heapq.nlargest(n, top, key=lambda prefix_hits: prefix_hits[1]))
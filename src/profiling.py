@@ -0,0 +1,212 @@
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
+
+if TYPE_CHECKING:
+    from .http_monitor import HTTPMonitor
+    from .sharding import ShardedMonitor
+
+# Which stage of the pipeline a source file belongs to
+STAGES = {
+    "file_observer.py": "tail",
+    "sampling.py": "tail",
+    "sharding.py": "dispatch",
+    "apache_log_parser": "parse",
+    "block_parser.py": "parse",
+    "log_parser.py": "parse",
+    "endpoints.py": "parse",
+    "metrics.py": "aggregate",
+    "cardinality.py": "aggregate",
+    "histogram.py": "aggregate",
+    "prefixes.py": "aggregate",
+    "alerts.py": "alerts",
+    "baselines.py": "alerts",
+    "display.py": "display",
+    "history.py": "history",
+}
+
+
+def get_stage(filename: str) -> Optional[str]:
+    for name, stage in STAGES.items():
+        if name in filename:
+            return stage
+    return None
+
+
+class SamplingProfiler:
+    """Statistical profiler sampling the stacks of all threads.
+
+    A background thread grabs the current frame of every other thread every
+    `interval` seconds, monitor threads aren't slowed down by tracing, and nothing
+    runs at all while the profiler is stopped.
+
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._running = threading.Event()
+
+    @property
+    def is_running(self) -> bool:
+        return self._running.is_set()
+
+    def start(self):
+        self.stacks = Counter()
+        self._running.set()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running.clear()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _sample(self):
+        own_ident = threading.get_ident()
+        while self._running.is_set():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+
+                stack = []
+                while frame:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)})"
+                    )
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+            time.sleep(self.interval)
+
+    def dump(self, path: str):
+        """Write collapsed stacks, ready for flamegraph.pl or speedscope."""
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class AllocationTracker:
+    """Diff of `tracemalloc` snapshots, attributed to the stages of the pipeline.
+
+    Tracing only runs between `start` and `stop`, as it slows down every allocation.
+
+    """
+
+    FRAMES = 25
+
+    def __init__(self):
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self.snapshot is not None
+
+    def start(self):
+        tracemalloc.start(self.FRAMES)
+        self.snapshot = tracemalloc.take_snapshot()
+
+    def stop(self) -> List[tracemalloc.StatisticDiff]:
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        previous, self.snapshot = self.snapshot, None
+
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        return snapshot.filter_traces(filters).compare_to(
+            previous.filter_traces(filters), "traceback"
+        )
+
+    @staticmethod
+    def get_stage_sizes(diffs: List[tracemalloc.StatisticDiff]) -> Dict[str, int]:
+        """Get allocated bytes per stage, from the most recent frame of ours."""
+        sizes: Dict[str, int] = defaultdict(int)
+        for diff in diffs:
+            stages = (get_stage(frame.filename) for frame in reversed(diff.traceback))
+            sizes[next(filter(None, stages), "other")] += diff.size_diff
+        return sizes
+
+    def dump(
+        self, path: str, diffs: List[tracemalloc.StatisticDiff], buckets: int, top=25
+    ):
+        sizes = self.get_stage_sizes(diffs)
+        with open(path, "w") as f:
+            f.write("Allocated bytes by stage:\n")
+            for stage, size in sorted(sizes.items(), key=lambda item: -item[1]):
+                f.write(f"  {stage}: {size:+,}\n")
+            if buckets:
+                # Not measured per bucket: the whole stage over the buckets we hold
+                f.write(
+                    "Aggregation divided by the {} buckets in the window: "
+                    "{:+,.0f}\n".format(buckets, sizes.get("aggregate", 0) / buckets)
+                )
+
+            f.write(f"\nTop {top} allocation sites:\n")
+            for diff in diffs[:top]:
+                f.write(f"{diff.size_diff:+,} bytes, {diff.count_diff:+} blocks\n")
+                for line in diff.traceback.format(limit=5, most_recent_first=True):
+                    f.write(f"  {line}\n")
+
+
+class ProfilingHooks:
+    """Profile a running monitor on demand, without restarting it.
+
+    - SIGUSR1 starts the sampling profiler, the next one stops it and dumps collapsed
+      stacks of all monitor threads.
+    - SIGUSR2 starts tracing allocations, the next one stops it and dumps the diff
+      between both snapshots.
+
+    Reports are written to `directory`. Until a signal arrives, hooks cost nothing.
+
+    """
+
+    def __init__(self, monitor: Union["HTTPMonitor", "ShardedMonitor"], directory: str):
+        self.monitor = monitor
+        self.directory = directory
+        self.profiler = SamplingProfiler()
+        self.allocations = AllocationTracker()
+
+    def install(self):
+        """Register signal handlers, it has to run in the main thread."""
+        os.makedirs(self.directory, exist_ok=True)
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.toggle_profiler())
+        signal.signal(signal.SIGUSR2, lambda signum, frame: self.toggle_allocations())
+
+    def get_path(self, name: str) -> str:
+        return os.path.join(
+            self.directory, "{}-{}".format(time.strftime("%Y%m%d-%H%M%S"), name)
+        )
+
+    def toggle_profiler(self):
+        if not self.profiler.is_running:
+            self.profiler.start()
+            print("Sampling profiler started.", flush=True)
+            return
+
+        self.profiler.stop()
+        path = self.get_path("profile.collapsed")
+        self.profiler.dump(path)
+        print(f"Sampling profiler stopped, stacks written to {path}", flush=True)
+
+    def toggle_allocations(self):
+        if not self.allocations.is_running:
+            self.allocations.start()
+            print("Allocation tracing started.", flush=True)
+            return
+
+        diffs = self.allocations.stop()
+        path = self.get_path("allocations.txt")
+        # Sharded monitors aggregate in worker processes, out of our reach
+        metrics = getattr(self.monitor, "metrics", None)
+        buckets = len(metrics.traffic_queue) if metrics else 0
+        self.allocations.dump(path, diffs, buckets)
+        print(f"Allocation tracing stopped, diff written to {path}", flush=True)
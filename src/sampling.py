@@ -0,0 +1,82 @@
+import math
+from typing import Optional
+
+
+class Sampler:
+    """Adaptive load-shedding sampler.
+
+    When the log rate exceeds what the monitor can parse we'd rather have
+    approximate numbers than fall minutes behind. The sampler picks lines to fully
+    parse before they reach the parser, every picked line then counts for `stride`
+    lines so the aggregated numbers stay unbiased estimates.
+
+    We only sample at 1/n rates, that way weights are integers and buckets can be
+    added/subtracted without floating point residues.
+
+    Args:
+        lag_target (float): Ingestion lag (seconds) we try to stay below.
+        max_stride (int): Lowest sample rate we're allowed to fall to (1/max_stride).
+
+    """
+
+    def __init__(self, lag_target: float, max_stride: int = 1024):
+        self.lag_target = lag_target
+        self.max_stride = max_stride
+        self.stride = 1
+        # Lines seen so far, mixed into the hash of every line
+        self.lines = 0
+
+    @property
+    def rate(self) -> float:
+        return 1 / self.stride
+
+    def should_parse(self, line: str) -> bool:
+        """Decide whether a raw line gets parsed.
+
+        Hashing the line is orders of magnitude cheaper than parsing it, and unlike a
+        plain counter it won't alias with periodic patterns in the log. The line
+        counter goes into the hash as well: floods often repeat byte-identical lines,
+        those would otherwise all be kept or all dropped together.
+
+        """
+        if self.stride == 1:
+            return True
+        self.lines += 1
+        return hash((line, self.lines)) % self.stride == 0
+
+    def adjust(self, lag: Optional[float]):
+        """Adjust the sample rate to the observed ingestion lag.
+
+        Multiplicative decrease / additive increase: halve the rate as soon as we're
+        behind the target, and slowly recover once we're comfortably below it.
+
+        Args:
+            lag (float): Seconds between now and the newest parsed log line.
+
+        """
+        if lag is None:
+            return
+
+        if lag > self.lag_target:
+            self.stride = min(self.stride * 2, self.max_stride)
+        elif lag < self.lag_target / 2 and self.stride > 1:
+            self.stride -= 1
+
+
+def get_relative_error(traffic: float, sampled: int, z: float = 1.96) -> float:
+    """Get the relative error of a sampled traffic estimate.
+
+    Each line is kept with probability p, so the estimate of N lines has a variance
+    of N(1 - p)/p, i.e. a relative standard error of sqrt((1 - p) / (p * N)).
+
+    Args:
+        traffic (float): Estimated number of lines.
+        sampled (int): Number of lines actually parsed.
+        z (float): Confidence level in standard deviations, 1.96 for 95%.
+
+    """
+    if not sampled or sampled >= traffic:
+        return 0.0
+
+    rate = sampled / traffic
+    return z * math.sqrt((1 - rate) / sampled)
@@ -0,0 +1,500 @@
+import glob
+import os
+import queue
+import signal
+import zlib
+from array import array
+from multiprocessing import Process, Queue
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from .alerts import (
+    BandwidthAlert,
+    DdosAlert,
+    ErrorRateAlert,
+    PrefixFloodAlert,
+    TrafficAlert,
+)
+from .cardinality import Cardinality
+from .display import Display
+from .endpoints import EndpointNormaliser, load_routes
+from .file_observer import FileObserver, LogsFileHandler
+from .histogram import LogLinearHistogram
+from .log_parser import AUTO, LOG_FORMAT, LineParser, detect_log_format, make_log_parser
+from .metrics import MetricBucket, MetricsAggregator
+from .prefixes import IPV6_PREFIXES, IpRanges, PrefixTree, load_ranges
+
+LINES = "LINES"
+REPORT = "REPORT"
+
+# Changes of a window since the last report, see `ReportedWindow`
+WindowChanges = Dict[str, Any]
+# Per file changes of the window, sketches and alerts a worker reports back
+FileChanges = Tuple[WindowChanges, Optional[Cardinality], List[Dict[str, str]]]
+# Per file window, sketches (only in stats reports) and alerts
+FileReport = Tuple[MetricBucket, Optional[Cardinality], List[Dict[str, str]]]
+
+
+class WorkerConfig(NamedTuple):
+    """Settings every worker builds its parsers and aggregators from."""
+
+    reporting_window: float
+    alert_threshold: float
+    bucket_size: float
+    alert_error_rate: float
+    ddos_threshold: float
+    unique_ips_jump: float
+    endpoint_depth: int
+    endpoint_routes: Optional[str]
+    max_endpoints: Optional[int]
+    log_format: str
+    bandwidth_threshold: Optional[float]
+    prefix_threshold: Optional[float]
+    ipv6_prefixes: Sequence[int]
+    ip_ranges: Optional[str]
+    vhosts: Dict[str, str]
+
+
+def expand_paths(patterns: List[str]) -> List[str]:
+    """Expand globs into a sorted list of unique existing files."""
+    paths: Set[str] = set()
+    for pattern in patterns:
+        paths.update(path for path in glob.glob(pattern) if os.path.isfile(path))
+    return sorted(paths)
+
+
+def get_vhosts(paths: List[str]) -> Dict[str, str]:
+    """Name every file after its path relative to the deepest common directory.
+
+    Files of a single directory go by their name, `/var/log/shop/access.log` and
+    `/var/log/blog/access.log` by `shop/access.log` and `blog/access.log`.
+
+    """
+    if not paths:
+        return {}
+
+    absolute = {path: os.path.abspath(path) for path in paths}
+    parent = os.path.commonpath([os.path.dirname(path) for path in absolute.values()])
+    return {path: os.path.relpath(absolute[path], parent) for path in paths}
+
+
+class ReportedWindow:
+    """Counters of a file's window as of the last report, to only send what changed.
+
+    Workers diff the window against their copy, the parent applies the changes to
+    its own, both copies staying the same. Requests hit an IP's count for as long
+    as the IP stays in the window, so between two alerts checks, most of a window
+    doesn't change. The response sizes histogram is diffed the same way, by index,
+    as BandwidthAlert needs it along with alerts. Sketches are only needed for stats
+    reports, and sent whole with them.
+
+    """
+
+    COUNTERS = (
+        "traffic_by_status_code",
+        "traffic_by_endpoint",
+        "traffic_by_ip",
+        "response_bytes_by_endpoint",
+    )
+    SCALARS = ("traffic", "sampled", "response_bytes")
+
+    def __init__(self):
+        self.window = MetricBucket()
+
+    def diff(self, stats: MetricBucket) -> WindowChanges:
+        """Get changes of `stats` since the last diff, and apply them to our copy."""
+        changes: WindowChanges = {name: getattr(stats, name) for name in self.SCALARS}
+        changes["response_sizes"] = {
+            index: count
+            for index, (count, old) in enumerate(
+                zip(stats.response_sizes.counts, self.window.response_sizes.counts)
+            )
+            if count != old
+        }
+        for name in self.COUNTERS:
+            counts, copy = getattr(stats, name), getattr(self.window, name)
+            changes[name] = (
+                {key: count for key, count in counts.items() if copy.get(key) != count},
+                [key for key in copy if key not in counts],
+            )
+        self.apply(changes)
+        return changes
+
+    def apply(self, changes: WindowChanges):
+        for name in self.SCALARS:
+            setattr(self.window, name, changes[name])
+        counts = self.window.response_sizes.counts
+        for index, count in changes["response_sizes"].items():
+            counts[index] = count
+        for name in self.COUNTERS:
+            copy = getattr(self.window, name)
+            updated, removed = changes[name]
+            copy.update(updated)
+            for key in removed:
+                del copy[key]
+
+    def get_window(self) -> MetricBucket:
+        """Get a copy of the window, ours keeps changing with the next reports."""
+        window = self.window
+        return MetricBucket(
+            traffic=window.traffic,
+            traffic_by_status_code=dict(window.traffic_by_status_code),
+            traffic_by_endpoint=dict(window.traffic_by_endpoint),
+            traffic_by_ip=dict(window.traffic_by_ip),
+            sampled=window.sampled,
+            response_bytes=window.response_bytes,
+            response_bytes_by_endpoint=dict(window.response_bytes_by_endpoint),
+            response_sizes=LogLinearHistogram(array("I", window.response_sizes.counts)),
+        )
+
+
+def make_prefix_tree(
+    config: WorkerConfig, ranges: Optional[IpRanges]
+) -> Optional[PrefixTree]:
+    if not config.prefix_threshold and not ranges:
+        return None
+    return PrefixTree(ipv6_prefixes=config.ipv6_prefixes, ranges=ranges)
+
+
+def run_worker(inbox: Queue, outbox: Queue, config: WorkerConfig):
+    """Worker process, parsing and aggregating the lines of its share of files.
+
+    Every file gets its own `MetricsAggregator`, the parent asks for their stats and
+    alerts with a `REPORT` message, lines of a file always come before that, as they
+    travel through the same queue. Answers carry the id of the request, and only
+    what changed since the previous one, see `ReportedWindow`, unless the parent
+    lost track and asks for whole windows.
+
+    """
+    # Profiling hooks only live in the parent, the default action of SIGUSR1/SIGUSR2
+    # would kill workers getting them, ie. when sent to the whole process group
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+    parent = os.getppid()
+    normaliser = EndpointNormaliser(
+        load_routes(config.endpoint_routes) if config.endpoint_routes else (),
+        config.endpoint_depth,
+        max_sections=config.max_endpoints,
+        window=config.reporting_window,
+    )
+    # Loaded once, shared by the prefix trees of every file
+    ranges = IpRanges(load_ranges(config.ip_ranges)) if config.ip_ranges else None
+    vhosts = config.vhosts
+    display = Display()
+    aggregators: Dict[str, MetricsAggregator] = {}
+    reported: Dict[str, ReportedWindow] = {}
+    # Files may come in different formats, each one is detected on its own
+    parsers: Dict[str, LineParser] = {}
+
+    while True:
+        try:
+            message = inbox.get(timeout=1)
+        except queue.Empty:
+            # Parent died without telling us (ie. os._exit), don't stay behind
+            if os.getppid() != parent:
+                return
+            continue
+
+        if message[0] == LINES:
+            _, path, lines = message
+            if path not in aggregators:
+                aggregators[path] = MetricsAggregator(
+                    config.reporting_window,
+                    config.alert_threshold,
+                    config.bucket_size,
+                    config.alert_error_rate,
+                    config.ddos_threshold,
+                    config.unique_ips_jump,
+                    bandwidth_threshold=config.bandwidth_threshold,
+                    prefix_threshold=config.prefix_threshold,
+                    prefixes=make_prefix_tree(config, ranges),
+                )
+            if path not in parsers:
+                if not any(lines):
+                    continue
+                log_format = config.log_format
+                if log_format == AUTO:
+                    log_format = detect_log_format(lines) or LOG_FORMAT
+                parsers[path] = make_log_parser(log_format, normaliser)
+
+            for line in lines:
+                if not line:
+                    continue
+
+                try:
+                    aggregators[path].add(parsers[path](line))
+                except Exception as e:
+                    display.warn(f"Error in log parsing ({vhosts[path]}):", e)
+
+        elif message[0] == REPORT:
+            _, report_id, with_alerts, whole = message
+            if whole:
+                reported.clear()
+            reports: Dict[str, FileChanges] = {}
+            for path, aggregator in aggregators.items():
+                window = reported.setdefault(path, ReportedWindow())
+                if with_alerts:
+                    # Sketches are only needed to display stats, don't merge them
+                    alerts = aggregator.get_alerts()
+                    reports[path] = (window.diff(aggregator.stats), None, alerts)
+                else:
+                    stats, cardinality = aggregator.get_window()
+                    reports[path] = (window.diff(stats), cardinality, [])
+            outbox.put((report_id, reports))
+
+
+class ShardConnection:
+    """Controller of a single file, forwarding its new lines to the file's worker."""
+
+    def __init__(self, path: str, inbox: Queue):
+        self.path = path
+        self.inbox = inbox
+
+    def add_lines(self, lines: List[str]):
+        self.inbox.put((LINES, self.path, lines))
+
+
+class ShardedFileObserver(FileObserver):
+    def __init__(self, connections: List[ShardConnection]):
+        super().__init__(None, None)
+        self.connections = connections
+
+    def make_handlers(self) -> Dict[str, LogsFileHandler]:
+        return {
+            connection.path: LogsFileHandler(connection.path, connection)
+            for connection in self.connections
+        }
+
+
+class ShardedMonitor:
+    """Monitor many log files (ie. one per vhost) from a single instance.
+
+    A single watcher in this process tails all the files, lines of every file are
+    sent to one of `workers` processes, picked by hashing the file path. Workers
+    parse and aggregate lines per file, and report back per file stats, which we
+    roll up into global stats and alerts.
+
+    Note:
+        Global alerts run over the rolled-up window with the same thresholds as
+        per file ones.
+
+    """
+
+    # Seconds a worker has to go through its queued lines and answer a report
+    REPORT_TIMEOUT = 30
+
+    def __init__(
+        self,
+        paths: List[str],
+        reporting_window: float,
+        alert_threshold: float,
+        bucket_size: float,
+        alert_error_rate: float,
+        alert_monitoring_window: float,
+        ddos_threshold: float,
+        unique_ips_jump: float = 2,
+        endpoint_depth: int = 1,
+        endpoint_routes: Optional[str] = None,
+        max_endpoints: Optional[int] = 1000,
+        workers: Optional[int] = None,
+        log_format: str = AUTO,
+        bandwidth_threshold: Optional[float] = None,
+        prefix_threshold: Optional[float] = None,
+        ipv6_prefixes: Sequence[int] = IPV6_PREFIXES,
+        ip_ranges: Optional[str] = None,
+    ):
+        # Initial configuration
+        self.paths = paths
+        self.vhosts = get_vhosts(paths)
+        self.reporting_window = reporting_window
+        self.alert_monitoring_window = alert_monitoring_window
+        config = WorkerConfig(
+            reporting_window,
+            alert_threshold,
+            bucket_size,
+            alert_error_rate,
+            ddos_threshold,
+            unique_ips_jump,
+            endpoint_depth,
+            endpoint_routes,
+            max_endpoints,
+            log_format,
+            bandwidth_threshold,
+            prefix_threshold,
+            ipv6_prefixes,
+            ip_ranges,
+            self.vhosts,
+        )
+
+        # Child objects
+        self.display = Display()
+        # Kept in sync with the reported windows of all files, see `apply_changes`
+        self.prefixes = make_prefix_tree(
+            config, IpRanges(load_ranges(ip_ranges)) if ip_ranges else None
+        )
+        self.alerts = [
+            TrafficAlert(reporting_window, alert_threshold),
+            *(
+                [BandwidthAlert(reporting_window, bandwidth_threshold)]
+                if bandwidth_threshold
+                else []
+            ),
+            ErrorRateAlert(reporting_window, alert_error_rate),
+            DdosAlert(reporting_window, ddos_threshold),
+            *(
+                [PrefixFloodAlert(reporting_window, prefix_threshold, self.prefixes)]
+                if prefix_threshold and self.prefixes
+                else []
+            ),
+        ]
+        self.inboxes: List[Queue] = [
+            Queue() for _ in range(min(workers or os.cpu_count() or 1, len(paths)))
+        ]
+        # One each, a worker dying halfway through an answer can't block the others
+        self.outboxes: List[Queue] = [Queue() for _ in self.inboxes]
+        self.workers = [
+            Process(target=run_worker, args=(inbox, outbox, config), daemon=True)
+            for inbox, outbox in zip(self.inboxes, self.outboxes)
+        ]
+        self._reports_lock = Lock()
+        self._report_id = 0
+        self._lost_reports = False
+        # Windows of every file as of the last report, see `ReportedWindow`
+        self.reported: Dict[str, ReportedWindow] = {}
+
+        # Initialize observers
+        self._metrics_reporting_thread = Thread(
+            target=self.report_metrics, name="metrics-reporting"
+        )
+        self.file_observer = ShardedFileObserver(
+            [ShardConnection(path, self.get_inbox(path)) for path in paths]
+        )
+        self._alerts_reporting_thread = Thread(
+            target=self.report_alerts, name="alerts-reporting"
+        )
+
+    def get_inbox(self, path: str) -> Queue:
+        return self.inboxes[zlib.crc32(path.encode()) % len(self.inboxes)]
+
+    def start(self):
+        # Fork workers before any thread of ours is running
+        for worker in self.workers:
+            worker.start()
+        self._metrics_reporting_thread.start()
+        self.file_observer.start()
+        self._alerts_reporting_thread.start()
+
+    def get_reports(self, with_alerts: bool = False) -> Dict[str, FileReport]:
+        """Ask every worker for the stats, and alerts, of its files.
+
+        Workers dead or not answering within `REPORT_TIMEOUT` are left out with a
+        warning, rather than hanging both reporting threads. A late answer is told
+        apart by its id, and dropped rather than taken for the next one.
+
+        """
+        with self._reports_lock:
+            self._report_id += 1
+            # Workers may have moved on with answers we didn't get, start over
+            whole, self._lost_reports = self._lost_reports, False
+            if whole:
+                self.reported.clear()
+                if self.prefixes:
+                    self.prefixes.clear()
+            for inbox in self.inboxes:
+                inbox.put((REPORT, self._report_id, with_alerts, whole))
+
+            reports: Dict[str, FileReport] = {}
+            missing = 0
+            deadline = monotonic() + self.REPORT_TIMEOUT
+            for worker, outbox in zip(self.workers, self.outboxes):
+                while True:
+                    try:
+                        report_id, worker_reports = outbox.get(timeout=1)
+                    except queue.Empty:
+                        if worker.is_alive() and monotonic() < deadline:
+                            continue
+                        missing += 1
+                        break
+
+                    if report_id == self._report_id:
+                        reports.update(self.apply_changes(worker_reports))
+                        break
+
+            if missing:
+                self._lost_reports = True
+                self.display.warn(
+                    "Error in reporting:", f"{missing} workers didn't report"
+                )
+            return reports
+
+    def apply_changes(self, changes: Dict[str, FileChanges]) -> Dict[str, FileReport]:
+        reports: Dict[str, FileReport] = {}
+        for path, (window_changes, cardinality, alerts) in changes.items():
+            window = self.reported.setdefault(path, ReportedWindow())
+            if self.prefixes:
+                # Changes carry new counts of an IP, the tree needs the difference
+                counts = window.window.traffic_by_ip
+                updated, removed = window_changes["traffic_by_ip"]
+                for ip, count in updated.items():
+                    self.prefixes.add(ip, count - counts.get(ip, 0))
+                for ip in removed:
+                    self.prefixes.add(ip, -counts[ip])
+            window.apply(window_changes)
+            reports[path] = (window.get_window(), cardinality, alerts)
+        return reports
+
+    @staticmethod
+    def roll_up(reports: Dict[str, FileReport]) -> Tuple[MetricBucket, Cardinality]:
+        stats = sum((report[0] for report in reports.values()), MetricBucket())
+        cardinality = Cardinality.merge_all(
+            report[1] for report in reports.values() if report[1]
+        )
+        return stats, cardinality
+
+    def report_metrics(self):
+        try:
+            while True:
+                sleep(self.reporting_window)
+                self.report_metrics_once()
+        except KeyboardInterrupt:
+            pass
+
+    def report_metrics_once(self):
+        reports = self.get_reports()
+        stats, cardinality = self.roll_up(reports)
+        self.display.send_stats(
+            {**stats.as_dict(), **cardinality.as_dict()}, self.reporting_window
+        )
+        self.display.send_vhost_stats(
+            {self.vhosts[path]: report[0].as_dict() for path, report in reports.items()}
+        )
+
+    def report_alerts(self):
+        try:
+            while True:
+                sleep(self.alert_monitoring_window)
+                self.report_alerts_once()
+        except KeyboardInterrupt:
+            pass
+
+    def report_alerts_once(self):
+        reports = self.get_reports(with_alerts=True)
+        for path, (_, _, alerts) in sorted(reports.items()):
+            for alert in alerts:
+                self.display.send_alert(
+                    {**alert, "message": f"[{self.vhosts[path]}] {alert['message']}"}
+                )
+
+        stats, _ = self.roll_up(reports)
+        # The metrics reporting thread updates the prefix tree along with its reports
+        with self._reports_lock:
+            changes = [alert.get_alert_status(stats) for alert in self.alerts]
+        for alert_status_changed in changes:
+            if alert_status_changed:
+                self.display.send_alert(
+                    {
+                        **alert_status_changed,
+                        "message": f"[global] {alert_status_changed['message']}",
+                    }
+                )
@@ -0,0 +1,154 @@
+import datetime
+import random
+from collections import deque
+from typing import Deque
+
+from src.alerts import AlertBase, TrafficAlert, TrafficBaselineAlert
+from src.baselines import RATIO, ZSCORE, Baseline, EwmaBaseline
+from src.metrics import MetricBucket, MetricsAggregator
+
+from .conftest import START_TIME, make_requests
+
+
+def test_ewma_baseline():
+    baseline = EwmaBaseline(half_life=10)
+    for i in range(100):
+        baseline.update(10 + (i % 2), dt=1)
+
+    assert baseline.is_ready
+    assert abs(baseline.mean - 10.5) < 0.1
+    assert abs(baseline.std - 0.5) < 0.1
+
+
+def test_baseline_deviation():
+    baseline = Baseline(half_life=10)
+    assert baseline.deviation(10, 0, ZSCORE) is None
+
+    for i in range(30):
+        baseline.update(10 + (i % 2), i)
+
+    assert baseline.deviation(10.5, 30, ZSCORE) < 1
+    assert baseline.deviation(20, 30, ZSCORE) > 3
+    assert abs(baseline.deviation(21, 30, RATIO) - 2) < 0.1
+
+
+def test_baseline_time_of_day_profile():
+    baseline = Baseline(half_life=3600, seasonal_days=1)
+    # Two days of a busy slot, and a quiet one right after it
+    for day in range(2):
+        for i in range(2 * Baseline.SLOT_SECONDS):
+            baseline.update(100 if i < Baseline.SLOT_SECONDS else 1, day * 86400 + i)
+
+    busy = baseline.expected(Baseline.SLOT_SECONDS / 2)
+    quiet = baseline.expected(Baseline.SLOT_SECONDS * 1.5)
+    assert abs(busy.mean - 100) < 1
+    assert abs(quiet.mean - 1) < 1
+
+
+def test_baseline_persistence(tmp_path):
+    path = str(tmp_path / "traffic.json")
+    baseline = Baseline(half_life=10, path=path)
+    for i in range(30):
+        baseline.update(5, i)
+    baseline.save()
+
+    restored = Baseline(half_life=10, path=path)
+    assert restored.ewma.as_dict() == baseline.ewma.as_dict()
+
+
+def test_metrics_baseline_alert():
+    now = START_TIME.timestamp()
+    baseline = Baseline(half_life=10)
+    for i in range(30):
+        baseline.update(4 + (i % 2), now - 30 + i)
+
+    metrics = MetricsAggregator(
+        reporting_window=5,
+        alert_threshold=100,
+        bucket_size=1,
+        alert_error_rate=0.05,
+        ddos_threshold=7.5,
+        traffic_baseline=baseline,
+    )
+    metrics.get_current_timestamp = lambda: now
+
+    # 5 requests/s is within the baseline, way below the fixed threshold
+    for data in make_requests(success=25):
+        metrics.add(data)
+    assert len(metrics.get_alerts()) == 0
+
+    # 10 requests/s is way above the baseline
+    for data in make_requests(success=25):
+        metrics.add(data)
+    metrics.get_current_timestamp = lambda: (
+        START_TIME + datetime.timedelta(seconds=1)
+    ).timestamp()
+    alerts = metrics.get_alerts()
+    assert len(alerts) == 1
+    assert alerts[0]["type"] == TrafficAlert.TYPE
+    assert alerts[0]["status"] == TrafficAlert.ALERT
+
+
+class FakeMetrics:
+    def __init__(self, now: float):
+        self.now = now
+
+    def get_current_timestamp(self) -> float:
+        return self.now
+
+
+def run_traffic_alert(baseline: Baseline, rates, start: float = 0):
+    """Check a traffic baseline alert once a second, get (time, status) changes.
+
+    Mimics a 10s reporting window of 1s buckets, feeding each bucket to the baseline
+    as it leaves the window.
+    """
+    metrics = FakeMetrics(start)
+    alert = TrafficBaselineAlert(10, 10, baseline, ZSCORE, 3, metrics)
+    window: Deque[int] = deque()
+    changes = []
+    for i, rate in enumerate(rates):
+        metrics.now = start + i
+        window.append(rate)
+        if len(window) > 10:
+            alert.add_bucket(
+                MetricBucket(timestamp=start + i - 10, traffic=window.popleft()), 1
+            )
+        change = alert.get_alert_status(MetricBucket(traffic=sum(window)))
+        if change:
+            changes.append((i, change["status"]))
+    return changes
+
+
+def test_baseline_alert_warms_up_above_the_threshold():
+    baseline = Baseline(half_life=60)
+    changes = run_traffic_alert(baseline, [20] * 300)
+
+    # Fires on the fixed threshold, recovers once the baseline learnt 20/s is normal
+    assert [status for _, status in changes] == [AlertBase.ALERT, AlertBase.RECOVERED]
+    assert changes[1][0] <= 90
+    assert baseline.ewma.is_ready
+
+
+def test_baseline_alert_adopts_a_lasting_level_shift():
+    baseline = Baseline(half_life=60)
+    changes = run_traffic_alert(baseline, [5] * 300 + [20] * 3000)
+
+    assert [status for _, status in changes] == [AlertBase.ALERT, AlertBase.RECOVERED]
+    # Values only count for a tenth while active, the shift takes longer than the
+    # baseline's half-life to become the new normal
+    assert changes[1][0] - changes[0][0] > 60
+
+
+def test_baseline_alert_follows_a_slow_ramp():
+    # Noisy traffic doubling over 3 hours, the usual morning rise
+    rng = random.Random(0)
+    rates = [
+        max(0, round(rng.gauss(rate, rate ** 0.5)))
+        for rate in (5 + 5 * min(i / 10800, 1) for i in range(4 * 3600))
+    ]
+    baseline = Baseline(half_life=600)
+    changes = run_traffic_alert(baseline, rates)
+
+    assert changes == []
+    assert baseline.ewma.is_ready
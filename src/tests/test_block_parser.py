@@ -0,0 +1,149 @@
+import time
+
+import pytest
+
+from src.block_parser import BlockParser, make_block, np
+from src.clock import VirtualClock
+from src.harness import RecordingDisplay
+from src.http_monitor import HTTPMonitor
+from src.log_parser import LOG_FORMAT, LOG_FORMATS, make_log_parser
+from src.metrics import MetricBucket, MetricsAggregator
+
+
+@pytest.fixture(params=[False, True], ids=["python", "numpy"])
+def use_numpy(request):
+    if request.param and np is None:
+        pytest.skip("NumPy isn't installed")
+    return request.param
+
+
+def make_aggregator() -> MetricsAggregator:
+    return MetricsAggregator(
+        reporting_window=10 ** 10,
+        alert_threshold=10,
+        bucket_size=5,
+        alert_error_rate=0.05,
+        ddos_threshold=7.5,
+    )
+
+
+@pytest.mark.parametrize("log_format", [LOG_FORMAT, LOG_FORMATS["combined"]])
+def test_block_matches_per_line_parsing(log_format, use_numpy):
+    buffer = make_block(2000, seconds=60)
+    if log_format != LOG_FORMAT:
+        buffer = buffer.replace(b"\n", b' "-" "curl/7.1"\n')
+
+    per_line, block = make_aggregator(), make_aggregator()
+    parse = make_log_parser(log_format)
+    for line in buffer.decode().split("\n"):
+        if line:
+            per_line.add(parse(line))
+    parser = BlockParser(log_format, bucket_size=5, use_numpy=use_numpy)
+    buckets, skipped = parser.parse(buffer)
+    block.add_buckets(buckets)
+
+    assert skipped == 0
+    assert [bucket.timestamp for bucket in buckets] == [
+        bucket.timestamp for bucket in per_line.traffic_queue
+    ]
+    assert block.get_stats() == per_line.get_stats()
+
+
+def test_block_counts_skipped_lines(use_numpy):
+    now = time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime())
+    buffer = (
+        f'127.0.0.1 - jill [{now}] "GET /api/user?id=1 HTTP/1.0" 500 234\n'
+        "\n"
+        "garbage\n"
+        f'127.0.0.2 - bob [{now}] "-" 408 -'
+    ).encode()
+
+    buckets, skipped = BlockParser(use_numpy=use_numpy).parse(buffer)
+
+    assert skipped == 1
+    assert len(buckets) == 1
+    assert buckets[0].traffic == 2
+    assert buckets[0].traffic_by_status_code == {"500s": 1, "400s": 1}
+    assert buckets[0].traffic_by_endpoint == {"/api": 1, "/": 1}
+
+
+def test_block_skips_lines_with_bad_times(use_numpy):
+    now = time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime())
+    buffer = (
+        f'127.0.0.1 - jill [{now}] "GET /api/user HTTP/1.0" 200 234\n'
+        '127.0.0.2 - bob [09/May/2018:16:00:41] "GET / HTTP/1.0" 200 234\n'
+        '127.0.0.3 - ann [09/Mai/2018:16:00:41 +0000] "GET / HTTP/1.0" 200 234\n'
+    ).encode()
+
+    buckets, skipped = BlockParser(use_numpy=use_numpy).parse(buffer)
+
+    assert skipped == 2
+    assert len(buckets) == 1
+    assert buckets[0].traffic_by_ip == {"127.0.0.1": 1}
+    assert buckets[0].traffic_by_endpoint == {"/api": 1}
+
+    buckets, skipped = BlockParser(use_numpy=use_numpy).parse(buffer.split(b"\n", 1)[1])
+    assert (buckets, skipped) == ([], 2)
+
+
+def test_monitor_warns_about_bad_blocks(tmp_path):
+    path = tmp_path / "access.log"
+    path.write_text("")
+    clock = VirtualClock(time.time())
+    monitor = HTTPMonitor(str(path), 120, 10, 1, 0.05, 10, 2.5, clock=clock)
+    monitor.display = RecordingDisplay(clock)
+
+    now = time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime(clock.time()))
+    monitor.add_block(
+        (
+            f'127.0.0.1 - jill [{now}] "GET /api/user HTTP/1.0" 200 234\n'
+            '127.0.0.2 - bob [09/May/2018:16:00:41] "GET / HTTP/1.0" 200 234\n'
+        ).encode()
+    )
+    assert monitor.display.warnings == 1
+    assert monitor.metrics.get_stats()["traffic"] == 1
+
+    def fail(buffer):
+        raise RuntimeError("boom")
+
+    monitor.block_parser.parse = fail
+    monitor.add_block(b"anything\n")
+    assert monitor.display.warnings == 2
+
+
+def test_monitor_replaces_invalid_utf8_in_json_blocks(tmp_path):
+    path = tmp_path / "access.log"
+    path.write_text("")
+    clock = VirtualClock(time.time())
+    monitor = HTTPMonitor(str(path), 120, 10, 1, 0.05, 10, 2.5, clock=clock)
+    monitor.display = RecordingDisplay(clock)
+
+    now = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(clock.time()))
+    line = (
+        f'{{"time_iso8601": "{now}", "remote_addr": "127.0.0.1", "remote_user": "-",'
+        ' "request": "GET /api/user HTTP/1.1", "status": 200, "body_bytes_sent": "234",'
+        ' "http_user_agent": "curl"}'
+    )
+    # A stray latin-1 byte in the user agent
+    monitor.add_block(f"{line}\n{line}\n".encode().replace(b"curl", b"curl\xe9"))
+
+    assert monitor.metrics.get_stats()["traffic"] == 2
+
+
+def test_add_buckets_merges_into_the_last_bucket(metrics):
+    now = int(time.time())
+    metrics.add_buckets([MetricBucket(now, 2, {"200s": 2}, {"/api": 2}, {"a": 2})])
+    metrics.add_buckets(
+        [
+            MetricBucket(now, 1, {"500s": 1}, {"/api": 1}, {"b": 1}),
+            MetricBucket(now + 1, 1, {"200s": 1}, {"/": 1}, {"a": 1}),
+        ]
+    )
+
+    assert len(metrics.traffic_queue) == 2
+    assert metrics.traffic_queue[0].traffic == 3
+    stats = metrics.get_stats()
+    assert stats["traffic"] == 4
+    assert stats["traffic_by_status_code"] == {"200s": 3, "500s": 1}
+    assert stats["traffic_by_ip"] == {"a": 3, "b": 1}
+    assert stats["unique_ips"] == 0
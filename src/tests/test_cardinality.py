@@ -0,0 +1,94 @@
+import datetime
+
+from src.alerts import UniqueIpsAlert
+from src.cardinality import Cardinality, HyperLogLog
+
+from .conftest import BASE_DATA_POINT, START_TIME, make_requests
+
+
+def test_hyperloglog_estimate():
+    sketch = HyperLogLog()
+    for i in range(10000):
+        sketch.add(f"10.0.{i // 256}.{i % 256}")
+
+    assert abs(sketch.count() - 10000) < 10000 * 0.1
+    assert len(sketch.registers) == 1024
+
+
+def test_hyperloglog_merge():
+    left, right = HyperLogLog(), HyperLogLog()
+    for i in range(500):
+        left.add(str(i))
+        right.add(str(i + 250))
+
+    assert abs(left.merge(right).count() - 750) < 750 * 0.1
+
+
+def test_cardinality_bounds_endpoints():
+    cardinality = Cardinality()
+    for i in range(Cardinality.MAX_ENDPOINTS * 2):
+        cardinality.add({**BASE_DATA_POINT, "request_url_subpath": f"/{i}"})
+
+    assert len(cardinality.unique_ips_by_endpoint) == Cardinality.MAX_ENDPOINTS
+
+
+def test_cardinality_marks_partial_endpoints(metrics):
+    metrics.add(make_requests(success=1, timedelta=-1)[0])
+    for i in range(Cardinality.MAX_ENDPOINTS):
+        metrics.add({**BASE_DATA_POINT, "request_url_subpath": f"/{i}"})
+    # Sketched in the first bucket, past the cap in the second
+    metrics.add(BASE_DATA_POINT)
+
+    stats = metrics.get_stats()
+    assert stats["unique_ips_by_endpoint"]["/api"] == 1
+    assert stats["partial_unique_ips_by_endpoint"] == {"/api"}
+
+
+def test_metrics_unique_counts(metrics):
+    for data in make_requests(success=40, random_ip=False):
+        metrics.add(data)
+    for data in make_requests(success=40, timedelta=1):
+        metrics.add({**data, "remote_logname": data["remote_host"]})
+
+    stats = metrics.get_stats()
+    assert abs(stats["unique_ips"] - 41) <= 2
+    assert abs(stats["unique_users"] - 41) <= 2
+    # Per endpoint sketches are kept at lower precision
+    assert abs(stats["unique_ips_by_endpoint"]["/api"] - 41) <= 8
+
+
+def test_metrics_unique_ips_alert(metrics):
+    # Start monitoring a whole window earlier
+    metrics.get_current_timestamp = lambda: (
+        START_TIME - datetime.timedelta(seconds=5)
+    ).timestamp()
+    assert len(metrics.get_alerts()) == 0
+
+    for data in make_requests(success=5, timedelta=-3):
+        metrics.add(data)
+    for data in make_requests(success=30):
+        metrics.add(data)
+
+    metrics.get_current_timestamp = lambda: (
+        START_TIME + datetime.timedelta(seconds=1)
+    ).timestamp()
+
+    alerts = [
+        alert for alert in metrics.get_alerts() if alert["type"] == UniqueIpsAlert.TYPE
+    ]
+    assert len(alerts) == 1 and alerts[0]["status"] == UniqueIpsAlert.ALERT
+
+
+def test_unique_ips_alert_waits_for_a_whole_window(metrics):
+    metrics.get_current_timestamp = START_TIME.timestamp
+    for data in make_requests(success=2):
+        metrics.add(data)
+    assert not metrics.get_alerts()
+
+    # The older half of the window only covers our first second of monitoring
+    metrics.get_current_timestamp = lambda: (
+        START_TIME + datetime.timedelta(seconds=4)
+    ).timestamp()
+    for data in make_requests(success=30, timedelta=3):
+        metrics.add(data)
+    assert not metrics.get_alerts()
@@ -0,0 +1,81 @@
+import pytest
+
+from src.clock import VirtualClock
+from src.endpoints import OTHER_SECTION, EndpointNormaliser
+from src.log_parser import Parser
+
+
+@pytest.mark.parametrize(
+    "path, expected",
+    [
+        ("/", "/"),
+        ("/api", "/api"),
+        ("/api/user", "/api"),
+        ("/12345/orders", "/{id}"),
+        ("/3f2504e0-4f89-11d3-9a0c-0305e82c3301", "/{uuid}"),
+        ("/5f3a9c0d1e2b", "/{hex}"),
+        ("/deadbeefcafe", "/deadbeefcafe"),
+    ],
+)
+def test_default_normalisation(path, expected):
+    assert EndpointNormaliser().normalise(path) == expected
+
+
+def test_depth_normalisation():
+    normaliser = EndpointNormaliser(depth=3)
+    assert normaliser.normalise("/users/12345/orders/678") == "/users/{id}/orders"
+
+
+def test_route_normalisation():
+    normaliser = EndpointNormaliser(
+        ["/users/{id}/orders", "/users/me/orders", "/static/**"], depth=2
+    )
+
+    assert normaliser.normalise("/users/12345/orders") == "/users/{id}/orders"
+    assert normaliser.normalise("/users/me/orders") == "/users/me/orders"
+    assert normaliser.normalise("/static/css/main.css") == "/static/**"
+    assert normaliser.normalise("/static") == "/static/**"
+    # No route matching, fall back to the rules
+    assert normaliser.normalise("/users/12345/orders/678") == "/users/{id}"
+
+
+def test_parser_normalises_endpoints():
+    parse = Parser.make_parser(normaliser=EndpointNormaliser(["/api/{version}/**"]))
+    data = parse(
+        """127.0.0.1 - jill [09/May/2018:16:00:41 +0000] "GET /api/v2/user/1 HTTP/1.0" 200 234"""
+    )
+
+    assert data["request_url_subpath"] == "/api/{version}/**"
+
+
+def test_sections_are_capped():
+    normaliser = EndpointNormaliser(["/static/**"], max_sections=3)
+    for path in ["/api/user", "/users/1", "/list"]:
+        normaliser.normalise(path)
+
+    assert normaliser.normalise("/wp-login.php") == OTHER_SECTION
+    assert normaliser.normalise("/.env") == OTHER_SECTION
+    # Sections seen before the cap, and explicit routes, keep their own
+    assert normaliser.normalise("/api/v2") == "/api"
+    assert normaliser.normalise("/static/main.css") == "/static/**"
+    assert len(normaliser.sections) == 3
+
+
+def test_sections_make_room_once_unseen_for_a_window():
+    clock = VirtualClock(0)
+    normaliser = EndpointNormaliser(max_sections=3, window=120, clock=clock)
+    normaliser.normalise("/api/user")
+    # Scanners fill the cap up
+    for i in range(10):
+        clock.now += 1
+        normaliser.normalise(f"/scan-{i}")
+    assert normaliser.normalise("/orders") == OTHER_SECTION
+
+    # Once they're gone, a real section shows up, and /api still gets traffic
+    clock.now = 100
+    normaliser.normalise("/api/user")
+    clock.now = 200
+    assert normaliser.normalise("/orders") == "/orders"
+    assert normaliser.normalise("/orders/12") == "/orders"
+    assert normaliser.normalise("/api/v2") == "/api"
+    assert list(normaliser.sections) == ["/scan-1", "/orders", "/api"]
@@ -0,0 +1,26 @@
+from src.alerts import TrafficAlert
+from src.harness import Phase, Scenario, run
+
+
+def test_harness_measures_traffic_alert():
+    scenario = Scenario(
+        "short-burst",
+        [Phase(20, 1), Phase(20, 20, incident=True), Phase(20, 1)],
+        TrafficAlert.TYPE,
+        # Few IPs, so the burst doesn't come with a jump in unique IPs
+        ips=5,
+    )
+    result = run(
+        scenario,
+        alert_monitoring_window=1,
+        bucket_size=1,
+        reporting_window=10,
+        ddos_threshold=10,
+    )
+
+    # 10 requests/s over 10s, reached after ~5s of 20 requests/s
+    assert 4 <= result.detection_delay <= 7
+    assert result.recovery_delay is not None
+    assert result.false_positives == 0
+    # 60 virtual seconds run way faster than real time
+    assert result.wall_time < 60
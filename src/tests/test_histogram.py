@@ -0,0 +1,103 @@
+import datetime
+
+from src.alerts import AlertBase, BandwidthAlert
+from src.histogram import LogLinearHistogram, format_bytes
+from src.metrics import MetricBucket, MetricsAggregator
+
+from .conftest import BASE_DATA_POINT, START_TIME, make_requests
+
+
+def test_histogram_relative_error():
+    for value in [0, 15, 16, 33, 234, 1000, 12345, 10 ** 6, 10 ** 9]:
+        highest = LogLinearHistogram.get_value(LogLinearHistogram.get_index(value))
+        assert value <= highest <= value * (1 + 1 / 16)
+
+
+def test_histogram_percentiles():
+    histogram = LogLinearHistogram()
+    for size in range(1, 1001):
+        histogram.add(size)
+
+    assert histogram.total == 1000
+    assert abs(histogram.percentile(0.5) - 500) <= 500 / 16
+    assert abs(histogram.percentile(0.99) - 990) <= 990 / 16
+    assert 1000 <= histogram.max <= 1000 * (1 + 1 / 16)
+    assert len(histogram.counts) == LogLinearHistogram.SIZE
+
+
+def test_histogram_add_and_subtract():
+    left, right = LogLinearHistogram(), LogLinearHistogram()
+    left.add(100, 3)
+    right.add(10 ** 6)
+
+    total = left + right
+    assert total.total == 4
+    assert (total - right).counts == left.counts
+    assert LogLinearHistogram().as_dict() == {"p50": 0, "p99": 0, "max": 0}
+
+
+def test_format_bytes():
+    assert format_bytes(234) == "234B"
+    assert format_bytes(5120) == "5.0KB"
+    assert format_bytes(3 * 1024 ** 3) == "3.0GB"
+
+
+def test_response_sizes_are_subtracted_on_expiry(metrics):
+    metrics.get_current_timestamp = START_TIME.timestamp
+    for data in make_requests(success=10, timedelta=-3):
+        metrics.add({**data, "response_bytes_clf": "1048576"})
+    for data in make_requests(success=90):
+        metrics.add(data)
+
+    stats = metrics.get_stats()
+    assert stats["response_bytes"] == 10 * 1048576 + 90 * 234
+    assert stats["response_size"]["max"] >= 1048576
+    assert stats["response_size_by_endpoint"]["/api"]["p99"] >= 1048576
+
+    metrics.get_current_timestamp = lambda: (
+        START_TIME + datetime.timedelta(seconds=3)
+    ).timestamp()
+
+    stats = metrics.get_stats()
+    assert stats["response_bytes"] == 90 * 234
+    assert stats["response_bytes_by_endpoint"] == {"/api": 90 * 234}
+    assert stats["response_size"]["max"] < 250
+    assert stats["response_size_by_endpoint"]["/api"]["max"] < 250
+
+
+def test_response_sizes_bound_endpoints():
+    bucket = MetricBucket(response_sizes_by_endpoint={})
+    for i in range(MetricBucket.MAX_RESPONSE_SIZE_ENDPOINTS * 2):
+        bucket.add_user({**BASE_DATA_POINT, "request_url_subpath": f"/{i}"})
+    bucket.add_user({**BASE_DATA_POINT, "response_bytes_clf": "-"})
+
+    assert len(bucket.response_sizes_by_endpoint) == (
+        MetricBucket.MAX_RESPONSE_SIZE_ENDPOINTS
+    )
+    assert len(bucket.response_bytes_by_endpoint) == (
+        MetricBucket.MAX_RESPONSE_SIZE_ENDPOINTS * 2 + 1
+    )
+    assert bucket.response_sizes.percentile(0) == 0
+
+
+def test_bandwidth_alert():
+    metrics = MetricsAggregator(
+        reporting_window=5,
+        alert_threshold=10,
+        bucket_size=1,
+        alert_error_rate=0.05,
+        ddos_threshold=7.5,
+        bandwidth_threshold=1000,
+    )
+    for data in make_requests(success=10):
+        metrics.add(data)
+    assert not metrics.get_alerts()
+
+    for data in make_requests(success=5):
+        metrics.add({**data, "response_bytes_clf": "1000"})
+
+    alerts = metrics.get_alerts()
+    assert len(alerts) == 1
+    assert alerts[0]["type"] == BandwidthAlert.TYPE
+    assert alerts[0]["status"] == AlertBase.ALERT
+    assert "1.4KB/s" in alerts[0]["message"]
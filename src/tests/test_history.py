@@ -0,0 +1,106 @@
+from array import array
+from threading import Thread
+
+import pytest
+
+from src.history import HistoryStore
+from src.metrics import MetricBucket
+
+START = 1525881600  # 09/May/2018:16:00:00 +0000
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    for i in range(2 * HistoryStore.SEGMENT_SPAN):
+        store.append(
+            MetricBucket(
+                START + i,
+                3,
+                {"200s": 2, "500s": 1},
+                {"/api": 2, f"/{i % 3}": 1},
+                {"127.0.0.1": 3},
+            )
+        )
+    return store
+
+
+def test_history_query_range(store):
+    result = store.query(START + 3590, START + 3610)
+
+    assert result.traffic == 60
+    assert result.sampled == 60
+    assert result.traffic_by_status_code == {"200s": 40, "500s": 20}
+    assert result.traffic_by_endpoint["/api"] == 40
+    assert result.traffic_by_ip == {"127.0.0.1": 60}
+
+
+def test_history_query_whole_segments(store):
+    assert len(store.get_segments(START + 10, START + 20)) == 1
+
+    result = store.query(START, START + 2 * HistoryStore.SEGMENT_SPAN)
+    assert result.traffic == 6 * HistoryStore.SEGMENT_SPAN
+    assert result.traffic_by_endpoint["/0"] == 2 * HistoryStore.SEGMENT_SPAN / 3
+
+
+def test_history_survives_reopening(store, tmp_path):
+    store.close()
+
+    reopened = HistoryStore(str(tmp_path))
+    reopened.append(MetricBucket(START + 10000, 1, {"200s": 1}, {"/new": 1}, {}))
+    assert reopened.query(START, START + 3 * HistoryStore.SEGMENT_SPAN).traffic == (
+        6 * HistoryStore.SEGMENT_SPAN + 1
+    )
+
+
+def test_history_compaction(store):
+    before = store.query(START + 60, START + 180)
+    store.compact(START + HistoryStore.SEGMENT_SPAN, resolution=60)
+
+    (segment, _) = store.get_segments()
+    assert segment.resolution == 60
+    assert len(segment.map_column("timestamp", "q")) == 60
+
+    after = store.query(START + 60, START + 180)
+    assert after.traffic == before.traffic
+    assert after.traffic_by_endpoint == before.traffic_by_endpoint
+
+
+def test_history_concurrent_appends(tmp_path):
+    store = HistoryStore(str(tmp_path))
+
+    def append(first: int):
+        for i in range(first, first + 3000):
+            store.append(MetricBucket(START + i, 5, {"200s": 5}, {"/api": 5}, {}))
+
+    threads = [Thread(target=append, args=(first,)) for first in (0, 3000)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    result = store.query(START, START + 6000)
+    assert result.traffic == 30000
+    assert result.traffic_by_endpoint == {"/api": 30000}
+
+
+def test_history_drops_partially_written_buckets(store, tmp_path):
+    store.close()
+    # Crash after the offsets of a bucket were written, before its timestamp
+    segment = store.get_segments()[-1]
+    with open(segment.column_path("endpoints.pairs"), "ab") as f:
+        f.write(array("I", [0, 7]).tobytes())
+    with open(segment.column_path("endpoints.offsets"), "ab") as f:
+        f.write(array("q", [10 ** 6]).tobytes())
+    with open(segment.column_path("endpoints.keys"), "ab") as f:
+        f.write(b"/partial")
+
+    reopened = HistoryStore(str(tmp_path))
+    reopened.append(
+        MetricBucket(START + 7199, 1, {"200s": 1}, {"/new": 1}, {"127.0.0.1": 1})
+    )
+    result = reopened.query(START + 7190, START + 7200)
+    assert result.traffic == 31
+    assert result.traffic_by_endpoint["/api"] == 20
+    assert result.traffic_by_endpoint["/new"] == 1
+    assert "/partial" not in reopened.get_segments()[-1].read_keys("endpoints")
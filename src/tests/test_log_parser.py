@@ -1,3 +1,15 @@
+import pytest
+
+from src.log_parser import (
+    LOG_FORMATS,
+    JsonLinesParser,
+    Parser,
+    detect_log_format,
+    make_log_parser,
+    parse_apache_time,
+)
+
+
 def test_parse_log(parser):
     data = parser(
         """127.0.0.1 - jill [09/May/2018:16:00:41 +0000] "GET /api/user HTTP/1.0" 200 234"""
@@ -16,3 +28,125 @@ def test_parse_log(parser):
 
     for key, value in expected.items():
         assert value == data[key]
+
+
+RECORD = {
+    "remote_host": "127.0.0.1",
+    "remote_logname": "jill",
+    "request_method": "GET",
+    "request_url_path": "/api/user",
+    "request_url_subpath": "/api",
+    "status": "200",
+    "response_bytes_clf": "234",
+}
+TIMESTAMP = 1525881641
+
+LINES = {
+    "clf": '127.0.0.1 - jill [09/May/2018:16:00:41 +0000] "GET /api/user HTTP/1.0"'
+    " 200 234",
+    "common": '127.0.0.1 - jill [09/May/2018:18:00:41 +0200] "GET /api/user?id=2'
+    ' HTTP/1.0" 200 234',
+    "combined": '127.0.0.1 - jill [09/May/2018:16:00:41 +0000] "GET /api/user HTTP/1.1"'
+    ' 200 234 "https://example.com/" "Mozilla/5.0 (X11; Linux x86_64)"',
+    "json": '{"time_iso8601": "2018-05-09T16:00:41+00:00", "remote_addr": "127.0.0.1",'
+    ' "remote_user": "jill", "request": "GET /api/user HTTP/1.1", "status": 200,'
+    ' "body_bytes_sent": "234", "http_user_agent": "curl \\"7.1\\""}',
+}
+
+
+@pytest.mark.parametrize("log_format", list(LINES))
+def test_fast_parsers_make_the_same_record(log_format):
+    data = make_log_parser(log_format)(LINES[log_format])
+
+    for key, value in RECORD.items():
+        assert data[key] == value
+    assert data["time_received_utc_datetimeobj"].timestamp() == TIMESTAMP
+
+
+def test_fast_parser_matches_apache_log_parser():
+    line = LINES["combined"]
+    log_format = LOG_FORMATS["combined"]
+
+    fast, slow = make_log_parser(log_format)(line), Parser.make_parser(log_format)(line)
+
+    for key in RECORD.keys() - {"remote_logname"}:
+        assert fast[key] == slow[key]
+    # The user is %u when the format has one, %l is only filled in by identd
+    assert fast["remote_logname"] == slow["remote_user"]
+    assert (
+        fast["time_received_utc_datetimeobj"] == slow["time_received_utc_datetimeobj"]
+    )
+
+
+def test_json_parser_decodes_escaped_values():
+    parse = JsonLinesParser().parse
+    data = parse(
+        '{"time_local": "09/May/2018:16:00:41 +0000", "remote_user": "j\\"ill",'
+        ' "request_method": "POST", "request_uri": "/api/user", "status": "500"}'
+    )
+
+    assert data["remote_logname"] == 'j"ill'
+    assert data["remote_host"] == "-"
+    assert data["request_method"] == "POST"
+    assert data["request_url_subpath"] == "/api"
+    assert data["time_received_utc_datetimeobj"].timestamp() == TIMESTAMP
+
+
+def test_json_parser_falls_back_on_other_layouts():
+    parse = JsonLinesParser().parse
+    parse(LINES["json"])
+
+    data = parse(
+        '{"status": "404", "request": "GET /api/user HTTP/1.1",'
+        ' "time_iso8601": "2018-05-09T16:00:41+00:00", "remote_addr": "127.0.0.1"}'
+    )
+
+    assert data["status"] == "404"
+    assert data["request_url_path"] == "/api/user"
+    assert data["remote_logname"] == "-"
+
+
+def test_parsers_reject_other_formats():
+    with pytest.raises(ValueError):
+        make_log_parser("json")(LINES["clf"])
+    with pytest.raises(ValueError):
+        make_log_parser("combined")(LINES["clf"])
+    with pytest.raises(ValueError):
+        make_log_parser("%h %t")
+
+
+@pytest.mark.parametrize(
+    "log_format, expected",
+    [
+        ("clf", "common"),
+        ("common", "common"),
+        ("combined", "combined"),
+        ("json", "json"),
+    ],
+)
+def test_detect_log_format(log_format, expected):
+    assert detect_log_format(["", LINES[log_format], "garbage"]) == expected
+
+
+def test_detect_unknown_log_format():
+    assert detect_log_format(["garbage", ""]) is None
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "[09/Mai/2018:16:00:41 +0000]",
+        "[09/May/2018:16:00:41]",
+        "[09/May/2018:16:00:41 0000]",
+        "[]",
+    ],
+)
+def test_parse_apache_time_rejects_bad_values(value):
+    with pytest.raises(ValueError):
+        parse_apache_time(value)
+
+
+def test_detect_log_format_skips_bad_times():
+    bad_month = LINES["common"].replace("/May/", "/Mai/")
+    assert detect_log_format([bad_month, LINES["common"]]) == "common"
+    assert detect_log_format([bad_month]) is None
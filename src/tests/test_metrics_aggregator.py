@@ -138,3 +138,47 @@ def test_metrics_alert_recoveres_with_traffic(metrics):
         and alerts[0]["type"] == TrafficAlert.TYPE
         and alerts[0]["status"] == TrafficAlert.RECOVERED
     )
+
+
+def test_metrics_bucket_size(metrics):
+    metrics.bucket_size = 5
+    for timedelta in range(5):
+        for data in make_requests(success=1, timedelta=timedelta):
+            metrics.add(data)
+
+    # All requests fall into at most 2 buckets, depending on the start time
+    assert len(metrics.traffic_queue) <= 2
+
+
+def test_metrics_ddos_threshold_is_per_second(metrics):
+    """30 requests from the same IP in 5 seconds are 6/s, below 7.5/s."""
+    for data in make_requests(success=30, random_ip=False):
+        metrics.add(data)
+    assert len(metrics.get_alerts()) == 0
+
+    for data in make_requests(success=8, random_ip=False):
+        metrics.add(data)
+    alerts = metrics.get_alerts()
+    assert [alert["type"] for alert in alerts] == [DdosAlert.TYPE]
+    assert "127.0.0.1 requests above threshold - 38" in alerts[0]["message"]
+
+
+def test_metrics_buckets_start_on_bucket_boundaries(metrics):
+    metrics.bucket_size = 5
+    metrics.get_current_timestamp = START_TIME.timestamp
+    for timedelta in range(-4, 1):
+        for data in make_requests(success=2, timedelta=timedelta):
+            metrics.add(data)
+
+    assert all(bucket.timestamp % 5 == 0 for bucket in metrics.traffic_queue)
+    assert all(
+        START_TIME.timestamp() - 10 < bucket.timestamp <= START_TIME.timestamp()
+        for bucket in metrics.traffic_queue
+    )
+
+    # Buckets leave the window like with 1s buckets
+    metrics.get_current_timestamp = lambda: (
+        START_TIME + datetime.timedelta(seconds=11)
+    ).timestamp()
+    assert metrics.get_stats()["traffic"] == 0
+    assert not metrics.traffic_queue
@@ -0,0 +1,114 @@
+import datetime
+
+from src.alerts import AlertBase, PrefixFloodAlert
+from src.metrics import MetricsAggregator
+from src.prefixes import IpRanges, PrefixTree, load_ranges
+
+from .conftest import BASE_DATA_POINT, START_TIME
+
+
+def make_botnet_requests(hits_per_ip: int = 1, timedelta: int = 0):
+    """Requests from 200 addresses spread over the /24s of 10.1.0.0/16."""
+    return [
+        {
+            **BASE_DATA_POINT,
+            "remote_host": f"10.1.{i}.{i + 1}",
+            "time_received_utc_datetimeobj": START_TIME
+            + datetime.timedelta(seconds=timedelta),
+        }
+        for i in range(200)
+        for _ in range(hits_per_ip)
+    ]
+
+
+def test_tree_counts_prefixes():
+    tree = PrefixTree(ipv6_prefixes=[48])
+    tree.update({"10.1.2.3": 3, "10.1.2.4": 2, "10.1.3.1": 1, "2001:db8:1::1": 4})
+    tree.add("-")
+
+    assert tree.get_top() == {
+        "10.1.0.0/16": 6,
+        "10.1.2.0/24": 5,
+        "2001:db8:1::/48": 4,
+        "10.1.3.0/24": 1,
+    }
+    assert tree.get_top(2) == {"10.1.0.0/16": 6, "10.1.2.0/24": 5}
+
+
+def test_tree_prunes_expired_prefixes():
+    tree = PrefixTree()
+    tree.update({"10.1.2.3": 3, "10.2.0.1": 1})
+    tree.subtract({"10.1.2.3": 3})
+
+    assert tree.get_top() == {"10.2.0.0/16": 1, "10.2.0.0/24": 1}
+    assert list(tree.roots[4].children) == [10 << 8 | 2]
+
+
+def test_heavy_prefixes_are_the_most_specific():
+    tree = PrefixTree()
+    tree.update({f"10.1.{i}.1": 1 for i in range(100)})
+    tree.update({"10.2.3.1": 30, "10.2.3.2": 30, "10.2.4.1": 1})
+
+    assert tree.get_heavy(50) == {"10.1.0.0/16": 100, "10.2.3.0/24": 60}
+    assert tree.get_heavy(1000) == {}
+
+
+def test_ranges_longest_prefix_match():
+    ranges = IpRanges(
+        [
+            ("52.16.0.0/15", "aws-eu-west-1"),
+            ("52.17.128.0/17", "aws-eu-west-1-lb"),
+            ("2a05:d018::/35", "aws-eu-west-1-v6"),
+            ("192.0.2.7/32", None),
+        ]
+    )
+    tree = PrefixTree(ranges=ranges)
+    tree.update({"52.16.0.1": 1, "52.17.200.1": 2, "2a05:d018::1": 3, "192.0.2.7": 4})
+
+    assert len(ranges) == 4
+    assert tree.traffic_by_range == {
+        "aws-eu-west-1": 1,
+        "aws-eu-west-1-lb": 2,
+        "aws-eu-west-1-v6": 3,
+        "192.0.2.7/32": 4,
+    }
+    assert ranges.match(4, int.from_bytes(bytes([8, 8, 8, 8]), "big")) is None
+
+
+def test_load_ranges(tmp_path):
+    path = tmp_path / "ranges.txt"
+    path.write_text("# AWS\n52.16.0.0/15 aws eu-west-1\n\n10.0.0.0/8  # private\n")
+
+    assert load_ranges(str(path)) == [
+        ("52.16.0.0/15", "aws eu-west-1"),
+        ("10.0.0.0/8", None),
+    ]
+
+
+def test_prefix_flood_alert():
+    metrics = MetricsAggregator(
+        reporting_window=5,
+        alert_threshold=1000,
+        bucket_size=1,
+        alert_error_rate=0.05,
+        ddos_threshold=7.5,
+        prefix_threshold=20,
+    )
+    metrics.get_current_timestamp = START_TIME.timestamp
+    for data in make_botnet_requests(hits_per_ip=1, timedelta=-3):
+        metrics.add(data)
+
+    # No single address goes above the DDoS threshold, their /16 does
+    alerts = metrics.get_alerts()
+    assert [alert["type"] for alert in alerts] == [PrefixFloodAlert.TYPE]
+    assert alerts[0]["status"] == AlertBase.ALERT
+    assert "10.1.0.0/16 requests above threshold - 200 (100%" in alerts[0]["message"]
+    assert metrics.get_stats()["traffic_by_prefix"]["10.1.0.0/16"] == 200
+
+    metrics.get_current_timestamp = lambda: (
+        START_TIME + datetime.timedelta(seconds=3)
+    ).timestamp()
+    alerts = metrics.get_alerts()
+    assert alerts[0]["type"] == PrefixFloodAlert.TYPE
+    assert alerts[0]["status"] == AlertBase.RECOVERED
+    assert metrics.get_stats()["traffic_by_prefix"] == {}
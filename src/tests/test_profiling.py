@@ -0,0 +1,102 @@
+import threading
+import time
+
+from src.file_observer import FileObserver
+from src.profiling import AllocationTracker, SamplingProfiler, get_stage
+
+from .conftest import make_requests
+
+
+def busy_loop(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampling_profiler(tmp_path):
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name="worker")
+    worker.start()
+
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    time.sleep(0.1)
+    profiler.stop()
+    stop.set()
+    worker.join()
+
+    assert any(
+        stack.startswith("worker;") and "busy_loop" in stack
+        for stack in profiler.stacks
+    )
+
+    path = tmp_path / "profile.collapsed"
+    profiler.dump(str(path))
+    stack, count = path.read_text().splitlines()[0].rsplit(" ", 1)
+    assert int(count) > 0
+
+
+def test_allocation_tracker_stages(metrics):
+    tracker = AllocationTracker()
+    tracker.start()
+    for data in make_requests(success=100):
+        metrics.add(data)
+    diffs = tracker.stop()
+
+    assert not tracker.is_running
+    assert AllocationTracker.get_stage_sizes(diffs)["aggregate"] > 0
+
+
+def test_get_stage():
+    assert get_stage("/root/package/src/metrics.py") == "aggregate"
+    assert get_stage("/root/package/src/block_parser.py") == "parse"
+    assert get_stage("/root/package/src/sampling.py") == "tail"
+    assert get_stage("/root/package/src/histogram.py") == "aggregate"
+    assert get_stage("/root/package/src/prefixes.py") == "aggregate"
+    assert get_stage("/root/package/src/sharding.py") == "dispatch"
+    assert get_stage("/usr/lib/python3/json/decoder.py") is None
+
+
+def test_allocation_dump_divides_aggregation_by_buckets(metrics, tmp_path):
+    tracker = AllocationTracker()
+    tracker.start()
+    for data in make_requests(success=100):
+        metrics.add(data)
+    diffs = tracker.stop()
+
+    path = tmp_path / "allocations.txt"
+    tracker.dump(str(path), diffs, buckets=4)
+    assert "Aggregation divided by the 4 buckets in the window: +" in path.read_text()
+
+
+class ThreadRecorder:
+    def __init__(self):
+        self.threads = []
+        self.added = threading.Event()
+
+    def add_lines(self, lines):
+        self.threads.append(threading.current_thread().name)
+        self.added.set()
+
+
+def test_observer_threads_are_named(tmp_path):
+    path = tmp_path / "access.log"
+    path.write_text("")
+    recorder = ThreadRecorder()
+    observer = FileObserver(str(path), recorder).make_observer()
+
+    assert observer.name == "file-observer-dispatch"
+    assert [emitter.name for emitter in observer.emitters] == [
+        f"file-observer-emitter:{tmp_path}"
+    ]
+
+    observer.start()
+    try:
+        with open(path, "a") as f:
+            f.write("line\n")
+        assert recorder.added.wait(5)
+    finally:
+        observer.stop()
+        observer.join()
+
+    # Lines are handled on watchdog's thread, not on the one `start` runs
+    assert set(recorder.threads) == {"file-observer-dispatch"}
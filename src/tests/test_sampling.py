@@ -0,0 +1,66 @@
+import pytest
+
+from src.helpers import parse_command_line
+from src.sampling import Sampler, get_relative_error
+
+from .conftest import make_requests
+
+
+def test_sampler_adjusts_to_lag():
+    sampler = Sampler(lag_target=2)
+    assert sampler.rate == 1
+
+    sampler.adjust(5)
+    sampler.adjust(5)
+    assert sampler.stride == 4
+
+    # Within target, but not comfortably below it - keep the rate
+    sampler.adjust(1.5)
+    assert sampler.stride == 4
+
+    sampler.adjust(0.5)
+    assert sampler.stride == 3
+
+
+def test_sampler_keeps_every_line_at_full_rate():
+    sampler = Sampler(lag_target=2)
+    assert all(sampler.should_parse(str(i)) for i in range(100))
+
+
+def test_sampler_keeps_a_share_of_duplicate_lines():
+    sampler = Sampler(lag_target=2)
+    sampler.stride = 8
+    line = '127.0.0.1 - jill [09/May/2018:16:00:41 +0000] "GET /api HTTP/1.0" 200 234'
+
+    kept = sum(sampler.should_parse(line) for _ in range(5000))
+    # 625 expected, ~25 standard deviation
+    assert 500 < kept < 750
+
+
+def test_sampled_metrics_are_scaled(metrics):
+    """Parse every 4th line, and check if the totals stay unbiased."""
+    for i, data in enumerate(make_requests(success=80, error=20)):
+        if i % 4 == 0:
+            metrics.add(data, weight=4)
+
+    stats = metrics.get_stats()
+    assert stats["traffic"] == 100
+    assert stats["sample_rate"] == 0.25
+    assert stats["traffic_by_status_code"]["200s"] == 80
+    assert stats["traffic_by_status_code"]["500s"] == 20
+    assert 0 < stats["sample_error"] < 1
+
+
+def test_relative_error_without_sampling():
+    assert get_relative_error(100, 100) == 0
+    assert get_relative_error(0, 0) == 0
+
+
+def test_block_mode_rejects_sampling(capsys):
+    assert parse_command_line(["-s", "2"]).sampling_lag_target == 2
+
+    with pytest.raises(SystemExit):
+        parse_command_line(["--block-mode", "-s", "2"])
+    assert "--sampling-lag-target can't be used with --block-mode" in (
+        capsys.readouterr().err
+    )
@@ -0,0 +1,223 @@
+import os
+import signal
+import time
+
+import pytest
+from watchdog.events import FileModifiedEvent
+
+from src.clock import VirtualClock
+from src.file_observer import FilesHandler
+from src.harness import RecordingDisplay
+from src.helpers import parse_command_line
+from src.metrics import MetricBucket
+from src.prefixes import PrefixTree
+from src.sharding import ReportedWindow, ShardedMonitor, expand_paths, get_vhosts
+
+LINE = '127.0.0.1 - jill [09/May/2018:16:00:41 +0000] "GET /api/user HTTP/1.0" {} 234'
+
+
+class Handler:
+    def __init__(self):
+        self.events = []
+
+    def on_modified(self, event):
+        self.events.append(event)
+
+
+def test_files_handler_ignores_other_files(tmp_path):
+    handler = Handler()
+    files_handler = FilesHandler({str(tmp_path / "a.log"): handler})
+
+    files_handler.on_modified(FileModifiedEvent(str(tmp_path / "a.log")))
+    files_handler.on_modified(FileModifiedEvent(str(tmp_path / "a.log.1")))
+    files_handler.on_modified(FileModifiedEvent(str(tmp_path / "sub" / "a.log")))
+
+    assert len(handler.events) == 1
+
+
+def test_expand_paths(tmp_path):
+    for name in ["a.log", "b.log", "c.txt"]:
+        (tmp_path / name).touch()
+
+    assert expand_paths([str(tmp_path / "*.log"), str(tmp_path / "a.log")]) == [
+        str(tmp_path / "a.log"),
+        str(tmp_path / "b.log"),
+    ]
+
+
+def test_paths_reject_single_file_options(tmp_path, capsys):
+    path = str(tmp_path / "a.log")
+    assert parse_command_line(["--paths", path]).paths == [path]
+    assert parse_command_line(["--block-mode"]).block_mode
+
+    with pytest.raises(SystemExit):
+        parse_command_line(["--paths", path, "--block-mode", "-s", "1"])
+    assert (
+        "--sampling-lag-target, --block-mode can't be used with --paths"
+        in capsys.readouterr().err
+    )
+
+
+def test_get_vhosts():
+    assert get_vhosts(["/var/log/shop/access.log", "/var/log/blog/access.log"]) == {
+        "/var/log/shop/access.log": "shop/access.log",
+        "/var/log/blog/access.log": "blog/access.log",
+    }
+    assert get_vhosts(["/var/log/a.log", "/var/log/b.log"]) == {
+        "/var/log/a.log": "a.log",
+        "/var/log/b.log": "b.log",
+    }
+    assert get_vhosts(["/var/log/a.log"]) == {"/var/log/a.log": "a.log"}
+
+
+def test_reported_window_sends_changes():
+    worker, parent = ReportedWindow(), ReportedWindow()
+    stats = MetricBucket(
+        traffic=6,
+        traffic_by_status_code={"200s": 6},
+        traffic_by_ip={"a": 3, "b": 2, "c": 1},
+    )
+    for size in [10, 10, 5000]:
+        stats.response_sizes.add(size)
+    parent.apply(worker.diff(stats))
+
+    stats.traffic_by_ip = {"a": 4, "b": 2}
+    stats.response_sizes.add(10)
+    changes = worker.diff(stats)
+    assert changes["traffic_by_ip"] == ({"a": 4}, ["c"])
+    assert changes["traffic_by_status_code"] == ({}, [])
+    # Only the histogram bucket that changed
+    assert changes["response_sizes"] == {10: 3}
+
+    parent.apply(changes)
+    assert parent.get_window().traffic_by_ip == {"a": 4, "b": 2}
+    assert parent.get_window().as_dict() == stats.as_dict()
+
+
+def make_monitor(tmp_path, **kwargs) -> ShardedMonitor:
+    paths = [str(tmp_path / f"vhost-{i}.log") for i in range(4)]
+    for path in paths:
+        open(path, "w").close()
+
+    return ShardedMonitor(
+        paths,
+        reporting_window=10 ** 9,
+        alert_threshold=10,
+        bucket_size=1,
+        alert_error_rate=0.05,
+        alert_monitoring_window=1,
+        ddos_threshold=10 ** 6,
+        workers=2,
+        **kwargs,
+    )
+
+
+def test_sharded_monitor_rolls_up_stats(tmp_path):
+    monitor = make_monitor(tmp_path)
+    paths = monitor.paths
+    assert len(monitor.workers) == 2
+    for worker in monitor.workers:
+        worker.start()
+
+    try:
+        for i, connection in enumerate(monitor.file_observer.connections):
+            connection.add_lines([LINE.format(200)] * (i + 1) + [LINE.format(500)])
+
+        reports = monitor.get_reports(with_alerts=True)
+        assert sorted(reports) == paths
+        assert [reports[path][0].traffic for path in paths] == [2, 3, 4, 5]
+        # Every vhost has an error rate way above 5%
+        assert all(reports[path][2] for path in paths)
+
+        stats, _ = monitor.roll_up(reports)
+        assert stats.traffic == 14
+        assert stats.traffic_by_status_code["500s"] == 4
+        # BandwidthAlert needs response sizes along with alerts
+        assert stats.response_sizes.total == 14
+        # Alerts checks don't need sketches
+        assert all(reports[path][1] is None for path in paths)
+
+        monitor.file_observer.connections[0].add_lines(
+            [LINE.replace("127.0.0.1", "10.0.0.1").format(200)]
+        )
+        reports = monitor.get_reports()
+        assert reports[paths[0]][0].traffic_by_ip == {"127.0.0.1": 2, "10.0.0.1": 1}
+        stats, cardinality = monitor.roll_up(reports)
+        assert stats.traffic == 15
+        assert cardinality.unique_ips.count() == 2
+
+        # Whole windows are sent again once an answer went missing
+        monitor._lost_reports = True
+        reports = monitor.get_reports()
+        assert monitor.roll_up(reports)[0].as_dict() == stats.as_dict()
+    finally:
+        for worker in monitor.workers:
+            worker.terminate()
+
+
+def test_sharded_monitor_keeps_prefixes_in_sync(tmp_path):
+    monitor = make_monitor(tmp_path, prefix_threshold=100)
+    worker = ReportedWindow()
+    path = monitor.paths[0]
+    stats = MetricBucket(
+        traffic=6, traffic_by_ip={"10.0.0.1": 3, "10.0.0.2": 2, "10.0.1.1": 1}
+    )
+    monitor.apply_changes({path: (worker.diff(stats), None, [])})
+
+    stats.traffic, stats.traffic_by_ip = 5, {"10.0.0.1": 4, "10.0.1.1": 1}
+    monitor.apply_changes({path: (worker.diff(stats), None, [])})
+
+    expected = PrefixTree()
+    expected.update(stats.traffic_by_ip)
+    assert monitor.prefixes.get_top() == expected.get_top()
+
+
+def test_sharded_monitor_survives_dead_workers(tmp_path):
+    monitor = make_monitor(tmp_path)
+    monitor.display = RecordingDisplay(VirtualClock(0))
+    for worker in monitor.workers:
+        worker.start()
+
+    try:
+        for connection in monitor.file_observer.connections:
+            connection.add_lines([LINE.format(200)])
+        # A late answer to an earlier request isn't taken for this one
+        monitor.outboxes[0].put((0, {"stale.log": None}))
+        assert sorted(monitor.get_reports()) == monitor.paths
+
+        monitor.workers[0].terminate()
+        monitor.workers[0].join()
+        began = time.monotonic()
+        reports = monitor.get_reports()
+
+        assert time.monotonic() - began < monitor.REPORT_TIMEOUT
+        assert sorted(reports) == [
+            path
+            for path in monitor.paths
+            if monitor.get_inbox(path) is monitor.inboxes[1]
+        ]
+        assert monitor.display.warnings == 1
+    finally:
+        for worker in monitor.workers:
+            worker.terminate()
+
+
+def test_sharded_workers_ignore_profiling_signals(tmp_path):
+    monitor = make_monitor(tmp_path)
+    for worker in monitor.workers:
+        worker.start()
+
+    try:
+        for connection in monitor.file_observer.connections:
+            connection.add_lines([LINE.format(200)])
+        # Once they answered, workers are past setting up their signal handlers
+        assert sorted(monitor.get_reports()) == monitor.paths
+        for worker in monitor.workers:
+            os.kill(worker.pid, signal.SIGUSR1)
+            os.kill(worker.pid, signal.SIGUSR2)
+
+        assert sorted(monitor.get_reports()) == monitor.paths
+        assert all(worker.is_alive() for worker in monitor.workers)
+    finally:
+        for worker in monitor.workers:
+            worker.terminate()